@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+# Measures how qbit_manage.py scales against a generated dataset served by fake_qbittorrent.py.
+# Every stage is run in its own qbit_manage.py process and reported with its wall time, the API calls it
+# made per endpoint, the bytes the fake WebUI sent and the peak RSS of the process.
+#   python benchmark/benchmark.py --torrents 10000
+#   python benchmark/benchmark.py --torrents 100000 --stages update_tags rem_orphaned --write
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+from fake_qbittorrent import Dataset, FakeQbittorrent, ROOT_DIR, TRACKERS, CATEGORIES, serve
+
+QBIT_MANAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'qbit_manage.py')
+STAGES = {
+    'update_category': '--cat-update',
+    'update_tags': '--tag-update',
+    'rem_unregistered': '--rem-unregistered',
+    'cross_seed': '--cross-seed',
+    'recheck': '--recheck',
+    'rem_orphaned': '--rem-orphaned',
+}
+
+
+def write_config(path, port, work_dir, options):
+    config = {
+        'qbt': {'host': f'http://127.0.0.1:{port}', 'user': 'admin', 'pass': 'adminadmin', 'max_workers': options.max_workers},
+        'directory': {
+            'cross_seed': os.path.join(work_dir, 'cross_seed', ''),
+            'root_dir': ROOT_DIR,
+            'remote_dir': os.path.join(work_dir, 'torrents', ''),
+        },
+        'recheck': {'max_concurrent': 4, 'poll_interval': 0.2},
+        'orphaned': {'workers': 4},
+        'cat': {category: f'{ROOT_DIR}{folder}' for category, folder in CATEGORIES.items()},
+        'tags': {keyword: keyword.split('.')[0].title() for keyword, url in TRACKERS if keyword},
+    }
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+
+
+# Run one stage in a child process and return (wall seconds, peak RSS in bytes, exit status)
+def run_stage(stage, config, work_dir, options):
+    command = [sys.executable, QBIT_MANAGE, '--config-file', config, '--log-file', os.path.join(work_dir, f'{stage}.log'),
+               STAGES[stage], '--log', options.log]
+    if not options.write:
+        command.append('--dry-run')
+    with open(os.path.join(work_dir, f'{stage}.out'), 'w') as output:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=output, stderr=subprocess.STDOUT, cwd=work_dir)
+        pid, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    return elapsed, peak_rss, process.returncode
+
+
+def main():
+    parser = argparse.ArgumentParser('qBit Manage benchmark.')
+    parser.add_argument('--torrents', type=int, default=1000, help='Number of torrents in the generated dataset (1k-200k).')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed used for the dataset.')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES), help='Stages to run, in order.')
+    parser.add_argument('--cross-seeds', type=int, help='Number of cross-seed .torrent files (default 1%% of --torrents).')
+    parser.add_argument('--orphans', type=int, help='Number of orphaned files in the directory tree (default 5%% of --torrents).')
+    parser.add_argument('--max-workers', type=int, default=8, help='qbt.max_workers used in the generated config.')
+    parser.add_argument('--write', action='store_true',
+                        help='Run without --dry-run. The dataset, cross-seed folder and tree are rebuilt before each stage.')
+    parser.add_argument('--work-dir', help='Folder for the config, logs, cross-seed files and directory tree (default: a temp folder).')
+    parser.add_argument('--keep', action='store_true', help='Keep the work folder after the run.')
+    parser.add_argument('--json', help='Also write the results to this file as JSON.')
+    parser.add_argument('--log', default='WARNING', help='Log level passed to qbit_manage.py.')
+    options = parser.parse_args()
+    cross_seeds = options.cross_seeds if options.cross_seeds is not None else max(options.torrents // 100, 1)
+    orphans = options.orphans if options.orphans is not None else max(options.torrents // 20, 1)
+
+    work_dir = options.work_dir or tempfile.mkdtemp(prefix='qbit_manage_benchmark_')
+    os.makedirs(work_dir, exist_ok=True)
+    start = time.perf_counter()
+    dataset = Dataset(options.torrents, options.seed)
+    print(f'Generated {options.torrents} torrents in {time.perf_counter() - start:.1f}s. Work folder: {work_dir}')
+
+    def prepare(stage):
+        if stage == 'cross_seed':
+            shutil.rmtree(os.path.join(work_dir, 'cross_seed'), ignore_errors=True)
+            dataset.write_cross_seeds(os.path.join(work_dir, 'cross_seed'), cross_seeds, options.seed)
+        if stage == 'rem_orphaned' and (options.write or not os.path.isdir(os.path.join(work_dir, 'torrents'))):
+            shutil.rmtree(os.path.join(work_dir, 'torrents'), ignore_errors=True)
+            dataset.write_tree(os.path.join(work_dir, 'torrents'), orphans, options.seed)
+        for name in os.listdir(work_dir):
+            if name.endswith('.db'):
+                os.remove(os.path.join(work_dir, name))
+
+    qbt = FakeQbittorrent(dataset)
+    server = serve(qbt)
+    config = os.path.join(work_dir, 'config.yml')
+    write_config(config, server.server_address[1], work_dir, options)
+    results = []
+    try:
+        for stage in options.stages:
+            prepare(stage)
+            if options.write:
+                qbt.reset()
+            qbt.reset_counters()
+            elapsed, peak_rss, status = run_stage(stage, config, work_dir, options)
+            with qbt.lock:
+                calls = dict(qbt.calls)
+                sent = sum(qbt.bytes_sent.values())
+            results.append({'stage': stage, 'seconds': round(elapsed, 3), 'api_calls': sum(calls.values()),
+                            'calls_per_endpoint': calls, 'bytes_sent': sent, 'peak_rss': peak_rss, 'exit_status': status})
+    finally:
+        server.shutdown()
+
+    print(f'\n{"Stage":<18}{"Wall (s)":>10}{"API calls":>11}{"MB sent":>9}{"Peak RSS (MB)":>15}  Top endpoints')
+    for result in results:
+        top = sorted(result['calls_per_endpoint'].items(), key=lambda item: item[1], reverse=True)[:3]
+        print(f'{result["stage"]:<18}{result["seconds"]:>10.2f}{result["api_calls"]:>11}{result["bytes_sent"] / 2 ** 20:>9.1f}'
+              f'{result["peak_rss"] / 2 ** 20:>15.1f}  ' + ', '.join(f'{endpoint}={count}' for endpoint, count in top)
+              + ('' if result['exit_status'] == 0 else f'  (exit status {result["exit_status"]}, see {result["stage"]}.out)'))
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({'torrents': options.torrents, 'write': options.write, 'results': results}, f, indent=2)
+    if not options.keep and not options.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0 if all(result['exit_status'] == 0 for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
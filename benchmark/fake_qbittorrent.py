@@ -0,0 +1,357 @@
+#!/usr/bin/python3
+
+# Stand-in for the qBittorrent Web API used by benchmark.py.
+# Serves a generated dataset (torrents, trackers, files and sync/maindata deltas) and applies the write
+# endpoints used by qbit_manage.py in memory. Every request is counted per endpoint.
+# It can also be started on its own to try qbit_manage.py against a large fake client:
+#   python benchmark/fake_qbittorrent.py --torrents 50000 --port 8080
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# (tracker keyword used in config.yml.sample, announce URL)
+TRACKERS = [
+    ('beyond-hd', 'https://beyond-hd.me/announce/{key}'),
+    ('privatehd', 'https://tracker.privatehd.to/{key}/announce'),
+    ('animebytes.tv', 'https://tracker.animebytes.tv/{key}/announce'),
+    ('avistaz', 'https://tracker.avistaz.to/{key}/announce'),
+    ('landof.tv', 'https://landof.tv/{key}/announce'),
+    ('passthepopcorn', 'http://please.passthepopcorn.me:2710/{key}/announce'),
+    ('torrentleech', 'https://tracker.torrentleech.org/a/{key}/announce'),
+    ('tleechreload', 'https://tracker.tleechreload.org/a/{key}/announce'),
+    ('gazellegames', 'https://tracker.gazellegames.net/{key}/announce'),
+    ('blutopia', 'https://blutopia.xyz/announce/{key}'),
+    ('hdts', 'https://hdts-announce.ru/announce.php?pid={key}'),
+    ('tv-vault', 'https://tv-vault.me/announce.php?passkey={key}'),
+    ('cartoonchaos', 'https://cartoonchaos.org/announce.php?passkey={key}'),
+    (None, 'https://tracker.example.org/{key}/announce'),
+]
+CATEGORIES = {'movies': 'Movies', 'tv': 'TV', 'music': 'Music'}
+# (tracker status, message, weight)
+TRACKER_STATES = [
+    (2, '', 90),
+    (4, 'Unregistered torrent', 4),
+    (4, 'Torrent not registered with this tracker', 2),
+    (4, 'Tracker is down', 4),
+]
+ROOT_DIR = '/data/torrents/'
+
+
+def bencode(value):
+    if isinstance(value, int):
+        return b'i%de' % value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b'%d:%s' % (len(value), value)
+    if isinstance(value, list):
+        return b'l' + b''.join(bencode(item) for item in value) + b'e'
+    return b'd' + b''.join(bencode(key) + bencode(item) for key, item in sorted(value.items())) + b'e'
+
+
+# Generated torrent table.
+# About a fifth of the torrents are cross-seeds of another torrent (same name and size, other tracker),
+# some of them still paused at 0% waiting for a recheck. A share of torrents have no category or tags yet.
+class Dataset:
+    def __init__(self, torrents=1000, seed=1):
+        rnd = random.Random(seed)
+        self.torrents = {}
+        self.trackers = {}
+        self.files = {}
+        originals = []
+        for i in range(torrents):
+            if originals and rnd.random() < 0.2:
+                original = rnd.choice(originals)
+                name, size, files, save_path = original['name'], original['total_size'], self.files[original['hash']], original['save_path']
+                cross_seed = True
+            else:
+                category = rnd.choice(list(CATEGORIES))
+                name = f'{CATEGORIES[category]}.Title.{i}.{rnd.choice(["1080p", "2160p", "720p"])}.WEB-DL'
+                files = [{'name': f'{name}/{name}.part{n}.mkv', 'size': rnd.randint(10 ** 6, 10 ** 9)}
+                         for n in range(rnd.choice([1, 1, 1, 2, 3]))]
+                size = sum(file['size'] for file in files)
+                save_path = f'{ROOT_DIR}{CATEGORIES[category]}/'
+                cross_seed = False
+            t_hash = hashlib.sha1(f'{seed}-{i}'.encode()).hexdigest()
+            state = rnd.choices(['uploading', 'stalledUP', 'pausedUP', 'downloading'], [30, 60, 7, 3])[0]
+            progress = 1 if state != 'downloading' else round(rnd.random(), 3)
+            if cross_seed and rnd.random() < 0.3:
+                state, progress = 'pausedDL', 0
+            torrent = {
+                'hash': t_hash,
+                'name': name,
+                'save_path': save_path,
+                'content_path': os.path.join(save_path, name),
+                'category': '' if rnd.random() < 0.1 else os.path.basename(save_path.rstrip('/')).lower(),
+                'tags': '' if rnd.random() < 0.1 else 'tagged',
+                'state': state,
+                'progress': progress,
+                'size': size,
+                'total_size': size,
+                'added_on': 1600000000 + i,
+                'completion_on': 1600000000 + i if progress == 1 else -1,
+                'num_seeds': rnd.randint(0, 50),
+                'num_leechs': rnd.randint(0, 5),
+                'upspeed': 0,
+                'dlspeed': 0,
+                'ratio': round(rnd.random() * 3, 3),
+                'tracker': '',
+                'trackers_count': 1,
+            }
+            keyword, url = rnd.choice(TRACKERS)
+            status, msg = rnd.choices([(s, m) for s, m, w in TRACKER_STATES], [w for s, m, w in TRACKER_STATES])[0]
+            url = url.format(key=hashlib.md5(url.encode()).hexdigest())
+            torrent['tracker'] = url if status == 2 else ''
+            self.torrents[t_hash] = torrent
+            self.trackers[t_hash] = [
+                {'url': '** [DHT] **', 'status': 2, 'tier': '', 'num_peers': 0, 'msg': ''},
+                {'url': '** [PeX] **', 'status': 2, 'tier': '', 'num_peers': 0, 'msg': ''},
+                {'url': '** [LSD] **', 'status': 2, 'tier': '', 'num_peers': 0, 'msg': ''},
+                {'url': url, 'status': status, 'tier': 0, 'num_peers': rnd.randint(0, 100), 'msg': msg},
+            ]
+            self.files[t_hash] = [dict(file, index=n, progress=progress) for n, file in enumerate(files)]
+            if not cross_seed:
+                originals.append(torrent)
+
+    # Write .torrent files for `count` existing torrents (plus a few unknown ones) the way cross-seed names them
+    def write_cross_seeds(self, path, count, seed=1):
+        rnd = random.Random(seed)
+        os.makedirs(path, exist_ok=True)
+        torrents = rnd.sample(list(self.torrents.values()), min(count, len(self.torrents)))
+        torrents += [{'name': f'Unknown.Title.{n}', 'hash': f'unknown{n}', 'total_size': 1} for n in range(max(count // 20, 1))]
+        for n, torrent in enumerate(torrents):
+            files = self.files.get(torrent['hash'], [{'name': torrent['name'], 'size': torrent['total_size']}])
+            info = {'name': torrent['name'], 'piece length': 2 ** 20, 'pieces': b'\0' * 20}
+            if len(files) == 1 and '/' not in files[0]['name']:
+                info['length'] = files[0]['size']
+            else:
+                info['files'] = [{'length': file['size'], 'path': file['name'].split('/')[1:]} for file in files]
+            with open(os.path.join(path, f'[movie][BHD]{torrent["name"]}.torrent'), 'wb') as f:
+                f.write(bencode({'announce': 'https://beyond-hd.me/announce/x', 'info': info}))
+
+    # Create every torrent file (empty) below `path`, which stands in for ROOT_DIR, plus `orphans` extra files
+    def write_tree(self, path, orphans, seed=1):
+        rnd = random.Random(seed)
+        dirs = set()
+        for t_hash, torrent in self.torrents.items():
+            for file in self.files[t_hash]:
+                file_path = os.path.join(path, torrent['save_path'][len(ROOT_DIR):], file['name'])
+                directory = os.path.dirname(file_path)
+                if directory not in dirs:
+                    os.makedirs(directory, exist_ok=True)
+                    dirs.add(directory)
+                open(file_path, 'a').close()
+        dirs = sorted(dirs)
+        for n in range(orphans):
+            directory = os.path.join(rnd.choice(dirs), f'orphaned.{n % 7}') if rnd.random() < 0.5 else rnd.choice(dirs)
+            os.makedirs(directory, exist_ok=True)
+            open(os.path.join(directory, f'leftover.{n}.nfo'), 'a').close()
+
+
+# In-memory qBittorrent state built from a Dataset.
+# Rechecks finish `recheck_time` seconds after they are requested. Writes are recorded for sync/maindata.
+class FakeQbittorrent:
+    def __init__(self, dataset, recheck_time=0.5):
+        self.dataset = dataset
+        self.recheck_time = recheck_time
+        self.calls = Counter()
+        self.bytes_sent = Counter()
+        self.lock = threading.RLock()
+        self.reset()
+
+    # Undo every write and start over from the dataset
+    def reset(self):
+        with self.lock:
+            self.torrents = {t_hash: dict(torrent) for t_hash, torrent in self.dataset.torrents.items()}
+            self.rid = 0
+            self.changed = {}
+            self.removed = set()
+            self.checking = {}
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls.clear()
+            self.bytes_sent.clear()
+
+    def _touch(self, t_hash, **fields):
+        self.torrents[t_hash].update(fields)
+        self.changed.setdefault(t_hash, {}).update(fields)
+
+    def _finish_rechecks(self):
+        now = time.monotonic()
+        for t_hash, deadline in list(self.checking.items()):
+            if deadline <= now:
+                del self.checking[t_hash]
+                if t_hash in self.torrents:
+                    self._touch(t_hash, state='pausedUP', progress=1)
+
+    def _torrents_info(self, query):
+        torrents = list(self.torrents.values())
+        if query.get('hashes'):
+            hashes = set(query['hashes'].split('|'))
+            torrents = [t for t in torrents if t['hash'] in hashes]
+        status = query.get('filter')
+        if status in ('paused', 'stopped'):
+            torrents = [t for t in torrents if t['state'].startswith(('paused', 'stopped'))]
+        elif status == 'completed':
+            torrents = [t for t in torrents if t['progress'] == 1]
+        if query.get('category') is not None:
+            torrents = [t for t in torrents if t['category'] == query['category']]
+        if query.get('sort'):
+            torrents.sort(key=lambda t: t.get(query['sort'], 0), reverse=query.get('reverse') in ('true', 'True'))
+        return torrents
+
+    def _maindata(self, query):
+        rid = int(query.get('rid', 0) or 0)
+        self.rid += 1
+        if rid == 0:
+            data = {'rid': self.rid, 'full_update': True,
+                    'torrents': {t_hash: {k: v for k, v in t.items() if k != 'hash'} for t_hash, t in self.torrents.items()},
+                    'categories': {c: {'name': c, 'savePath': ''} for c in CATEGORIES}, 'tags': ['tagged']}
+        else:
+            data = {'rid': self.rid,
+                    'torrents': {t_hash: fields for t_hash, fields in self.changed.items() if t_hash in self.torrents}}
+            if self.removed:
+                data['torrents_removed'] = sorted(self.removed)
+        self.changed = {}
+        self.removed = set()
+        return data
+
+    # Returns the response body (str for text responses) for an API endpoint such as 'torrents/info'
+    def handle(self, endpoint, query):
+        with self.lock:
+            self.calls[endpoint] += 1
+            self._finish_rechecks()
+            hashes = [h for h in query.get('hashes', '').split('|') if h in self.torrents]
+            if query.get('hashes') == 'all':
+                hashes = list(self.torrents)
+            if endpoint == 'auth/login':
+                return 'Ok.'
+            if endpoint == 'auth/logout':
+                return ''
+            if endpoint == 'app/version':
+                return 'v4.6.7'
+            if endpoint == 'app/webapiVersion':
+                return '2.9.3'
+            if endpoint == 'app/buildInfo':
+                return {'qt': '6.6.0', 'libtorrent': '2.0.9.0', 'boost': '1.83.0', 'openssl': '3.1.4', 'bitness': 64}
+            if endpoint == 'torrents/info':
+                return self._torrents_info(query)
+            if endpoint == 'torrents/trackers':
+                return self.dataset.trackers.get(query.get('hash'), [])
+            if endpoint == 'torrents/files':
+                return self.dataset.files.get(query.get('hash'), [])
+            if endpoint == 'sync/maindata':
+                return self._maindata(query)
+            if endpoint == 'torrents/setCategory':
+                for t_hash in hashes:
+                    self._touch(t_hash, category=query.get('category', ''))
+            elif endpoint == 'torrents/addTags':
+                for t_hash in hashes:
+                    tags = [tag for tag in self.torrents[t_hash]['tags'].split(', ') if tag]
+                    tags += [tag for tag in query.get('tags', '').split(',') if tag and tag not in tags]
+                    self._touch(t_hash, tags=', '.join(tags))
+            elif endpoint in ('torrents/resume', 'torrents/start'):
+                for t_hash in hashes:
+                    complete = self.torrents[t_hash]['progress'] == 1
+                    self._touch(t_hash, state='stalledUP' if complete else 'downloading')
+            elif endpoint in ('torrents/pause', 'torrents/stop'):
+                for t_hash in hashes:
+                    complete = self.torrents[t_hash]['progress'] == 1
+                    self._touch(t_hash, state='pausedUP' if complete else 'pausedDL')
+            elif endpoint == 'torrents/recheck':
+                for t_hash in hashes:
+                    self._touch(t_hash, state='checkingUP')
+                    self.checking[t_hash] = time.monotonic() + self.recheck_time
+            elif endpoint == 'torrents/delete':
+                for t_hash in hashes:
+                    del self.torrents[t_hash]
+                    self.changed.pop(t_hash, None)
+                    self.removed.add(t_hash)
+            elif endpoint == 'torrents/add':
+                return 'Ok.'
+            return ''
+
+
+def make_handler(qbt):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, query):
+            endpoint = urlparse(self.path).path.split('/api/v2/', 1)[-1]
+            body = qbt.handle(endpoint, {key: values[0] for key, values in query.items()})
+            if isinstance(body, str):
+                content_type = 'text/plain; charset=UTF-8'
+                body = body.encode()
+            else:
+                content_type = 'application/json'
+                body = json.dumps(body, separators=(',', ':')).encode()
+            with qbt.lock:
+                qbt.bytes_sent[endpoint] += len(body)
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            if endpoint == 'auth/login':
+                self.send_header('Set-Cookie', 'SID=benchmark; HttpOnly; path=/')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._reply(parse_qs(urlparse(self.path).query, keep_blank_values=True))
+
+        def do_POST(self):
+            raw = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+            query = parse_qs(urlparse(self.path).query, keep_blank_values=True)
+            if 'x-www-form-urlencoded' in self.headers.get('Content-Type', ''):
+                query.update(parse_qs(raw.decode('utf-8', errors='replace'), keep_blank_values=True))
+            self._reply(query)
+
+    return Handler
+
+
+# Start the server on a background thread and return it (server.server_address holds the bound port)
+def serve(qbt, host='127.0.0.1', port=0):
+    server = ThreadingHTTPServer((host, port), make_handler(qbt))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Fake qBittorrent Web API.')
+    parser.add_argument('--torrents', type=int, default=1000, help='Number of torrents to generate.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed used for the dataset.')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on.')
+    parser.add_argument('--cross-seed-dir', help='Write cross-seed .torrent files for 1%% of the torrents to this folder.')
+    parser.add_argument('--tree-dir', help='Create the torrent files and some orphans below this folder.')
+    parser.add_argument('--orphans', type=int, default=100, help='Number of orphaned files created in --tree-dir.')
+    options = parser.parse_args()
+    dataset = Dataset(options.torrents, options.seed)
+    if options.cross_seed_dir:
+        dataset.write_cross_seeds(options.cross_seed_dir, max(options.torrents // 100, 1), options.seed)
+    if options.tree_dir:
+        dataset.write_tree(options.tree_dir, options.orphans, options.seed)
+    qbt = FakeQbittorrent(dataset)
+    server = serve(qbt, port=options.port)
+    print(f'Serving {options.torrents} torrents on http://127.0.0.1:{server.server_address[1]}')
+    try:
+        while True:
+            time.sleep(10)
+            with qbt.lock:
+                if qbt.calls:
+                    print(dict(qbt.calls))
+                qbt.reset_counters()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,16 +1,26 @@
 #!/usr/bin/python3
 
 import os
-import shutil
-import yaml
+import sys
 import argparse
 import logging
 import logging.handlers
-from qbittorrentapi import Client
-import urllib3
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from collections import Counter
-import glob
-from pathlib import Path
+import time
+import errno
+import re
+import contextlib
+import threading
+import queue
+import json
+import atexit
+import datetime
+import contextvars
+import functools
+import urllib.parse
+# Modules only some commands need (yaml, qbittorrentapi, sqlite3, shutil, http.server, ctypes) are imported
+# where they are used, so short runs from cron jobs and hooks start quickly.
 
 # import apprise
 
@@ -64,6 +74,34 @@ parser.add_argument('-ro', '--rem-orphaned',
                     help='Use this if you would like to remove orphaned files from your `root_dir` directory that are not referenced by any torrents.'
                     ' It will scan your `root_dir` directory and compare it with what is in Qbitorrent. Any data not referenced in Qbitorrent will be moved into '
                     ' `/data/torrents/orphaned_data` folder for you to review/delete.')
+parser.add_argument('-d', '--daemon',
+                    dest='daemon',
+                    action='store_const',
+                    const='daemon',
+                    help='Keep running and repeat the selected commands every `--interval` seconds.'
+                         ' Only torrents that changed since the last run are processed.')
+parser.add_argument('-i', '--interval',
+                    dest='interval',
+                    action='store',
+                    type=int,
+                    default=600,
+                    help='Number of seconds to wait between runs in daemon mode.')
+parser.add_argument('-w', '--watch',
+                    dest='watch',
+                    action='store_const',
+                    const='watch',
+                    help='Use with --cross-seed to watch the cross-seed output folder (Linux only) and add new .torrent files'
+                         ' as soon as they are written. Runs in daemon mode.')
+parser.add_argument('--report-file',
+                    dest='reportfile',
+                    action='store',
+                    help='JSON Lines file the result for every torrent and file is written to.'
+                         ' Defaults to the log file name with a .jsonl extension. Example: activity.jsonl')
+parser.add_argument('--hash',
+                    dest='hashes',
+                    action='append',
+                    help='Only process the torrent with this info hash instead of listing every torrent, e.g. from'
+                         ' qBittorrent\'s "Run external program on torrent added" with %%I. Can be given several times.')
 parser.add_argument('--dry-run',
                     dest='dry_run',
                     action='store_const',
@@ -76,16 +114,97 @@ parser.add_argument('--log',
                     default='INFO',
                     help='Change your log level. ')
 args = parser.parse_args()
+if args.watch == 'watch' and args.cross_seed != 'cross_seed':
+    parser.error('--watch requires --cross-seed')
+if args.hashes and (args.daemon == 'daemon' or args.watch == 'watch'):
+    parser.error('--hash can not be used with --daemon or --watch')
+
+# Bumped whenever validate_config() changes so configs cached by an older version are validated again
+config_cache_version = 2
+
+
+# One `unregistered:` entry as a group of the combined pattern. A leading global flag such as (?i) only
+# applies to that entry, so it is turned into a scoped flag group.
+def unregistered_group(pattern):
+    flags = re.match(r'\(\?([imsx]+)\)', pattern)
+    if flags:
+        return f'(?{flags[1]}:{pattern[flags.end():]})'
+    return f'(?:{pattern})'
+
 
-with open(args.config, 'r') as cfg_file:
-    cfg = yaml.load(cfg_file, Loader=yaml.FullLoader)
+# Check the parts of the config every run relies on, so a broken config fails here with a clear message
+# instead of half way through a run
+def validate_config(config, path):
+    if not isinstance(config, dict):
+        parser.error(f'{path} is not a YAML mapping')
+    qbt = config.get('qbt')
+    for qbt_cfg in qbt if isinstance(qbt, list) else [qbt]:
+        if not isinstance(qbt_cfg, dict) or not qbt_cfg.get('host'):
+            parser.error(f'{path}: every qbt instance needs a host')
+    for section in ('cat', 'tags'):
+        if not isinstance(config.get(section), dict):
+            parser.error(f'{path}: {section} must be a mapping')
+    for section in ('directory', 'recheck', 'orphaned', 'metrics'):
+        if not isinstance(config.get(section) or {}, dict):
+            parser.error(f'{path}: {section} must be a mapping')
+    unregistered = config.get('unregistered') or []
+    if not isinstance(unregistered, list) or not all(isinstance(pattern, str) for pattern in unregistered):
+        parser.error(f'{path}: unregistered must be a list of strings')
+    for pattern in unregistered:
+        try:
+            matches_empty = re.search(unregistered_group(pattern), '') is not None
+        except re.error as e:
+            parser.error(f'{path}: invalid unregistered pattern {pattern!r}: {e}')
+        # Working trackers have an empty message: such a pattern would remove every torrent
+        if matches_empty:
+            parser.error(f'{path}: unregistered pattern {pattern!r} matches an empty tracker message')
 
-urllib3.disable_warnings()
+
+# Load and validate the config. The validated config is cached as JSON next to it (config.cache.json) and
+# reused as long as the config file is unchanged, so most runs don't import or run the YAML parser at all.
+# Configs that don't survive a JSON round trip (e.g. YAML dates or non-string keys) are not cached.
+def load_config(path):
+    stat = os.stat(path)
+    key = [config_cache_version, stat.st_mtime_ns, stat.st_size]
+    cache_file = os.path.splitext(path)[0] + '.cache.json'
+    try:
+        with open(cache_file, 'r') as f:
+            cached = json.load(f)
+        if cached['key'] == key:
+            return cached['config']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    import yaml
+    with open(path, 'r') as cfg_file:
+        config = yaml.load(cfg_file, Loader=yaml.FullLoader)
+    validate_config(config, path)
+    try:
+        if json.loads(json.dumps(config)) == config:
+            tmp_path = f'{cache_file}.{os.getpid()}.tmp'
+            # The cache holds the same passwords as the config, so it is created with the config's permissions
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, stat.st_mode & 0o777)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'key': key, 'config': config}, f)
+            os.replace(tmp_path, cache_file)
+    except (OSError, TypeError, ValueError):
+        pass
+    return config
+
+
+cfg = load_config(args.config)
+# `qbt` is either one instance or a list of them
+qbt_cfgs = cfg['qbt'] if isinstance(cfg['qbt'], list) else [cfg['qbt']]
+if args.watch == 'watch' and len(qbt_cfgs) > 1:
+    parser.error('--watch only supports a single qbt instance')
 
 file_name_format = args.logfile
-msg_format = '%(asctime)s - %(levelname)s: %(message)s'
+report_file = args.reportfile or os.path.splitext(args.logfile)[0] + '.jsonl'
+# SQLite database next to the config file used to keep state between runs (file index, recheck queue)
+db_file = os.path.splitext(args.config)[0] + '.db'
+msg_format = '%(asctime)s - %(levelname)s: %(instance)s%(message)s'
 max_bytes = 1024 * 1024 * 2
 backup_count = 5
+report_max_bytes = 1024 * 1024 * 10
 
 logger = logging.getLogger('qBit Manage')
 logging.DRYRUN = 25
@@ -94,175 +213,1082 @@ setattr(logger, 'dryrun', lambda dryrun, *args: logger._log(logging.DRYRUN, dryr
 log_lev = getattr(logging, args.loglevel.upper())
 logger.setLevel(log_lev)
 
+# Name of the qBittorrent instance the current thread is working on. With several instances it prefixes
+# every log line and it labels the run report records and metrics.
+current_instance = contextvars.ContextVar('instance', default='')
+
+
+def add_instance(record):
+    name = current_instance.get()
+    record.instance = f'[{name}] ' if name and len(qbt_cfgs) > 1 else ''
+    return True
+
+
+logger.addFilter(add_instance)
+
 file_handler = logging.handlers.RotatingFileHandler(filename=file_name_format,
                                                     maxBytes=max_bytes,
                                                     backupCount=backup_count)
 file_handler.setLevel(log_lev)
 file_formatter = logging.Formatter(msg_format)
 file_handler.setFormatter(file_formatter)
-logger.addHandler(file_handler)
 
 stream_handler = logging.StreamHandler()
 stream_handler.setLevel(log_lev)
 stream_formatter = logging.Formatter(msg_format)
 stream_handler.setFormatter(stream_formatter)
-logger.addHandler(stream_handler)
 
-# Actual API call to connect to qbt.
-host = cfg['qbt']['host']
-if 'user' in cfg['qbt']:
-    username = cfg['qbt']['user']
-else:
-    username = ''
-if 'pass' in cfg['qbt']:
-    password = cfg['qbt']['pass']
-else:
-    password = ''
+# The file and stream handlers run on a background thread fed by a queue, so writing and rolling the log
+# never blocks the stages. The listener is stopped (and the queue drained) on exit.
+log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+log_listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+
+# Formats a run report record (a dict passed as the log message) as one JSON line
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        item = {'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds')}
+        item.update(record.msg)
+        return json.dumps(item, ensure_ascii=False)
+
+
+# Puts report records on the queue as they are; they are serialized by the listener thread instead of the stage
+class ReportQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+# Rolls the report over only when a run starts (RunReport.start() queues a record without a message), never
+# during a run, so the records of one run stay in one file however large the run is.
+class RunReportHandler(logging.handlers.RotatingFileHandler):
+    def emit(self, record):
+        if record.msg is not None:
+            logging.FileHandler.emit(self, record)
+            return
+        try:
+            if os.path.isfile(self.baseFilename) and os.path.getsize(self.baseFilename) >= self.maxBytes:
+                self.doRollover()
+        except OSError:
+            self.handleError(record)
+
+
+# Per-item results (every torrent tagged, deleted, rechecked, every orphan moved...) go to the run report,
+# one JSON record at a time, while the log above only gets the summary of each stage.
+class RunReport:
+    def __init__(self, path):
+        self.logger = logging.getLogger('qBit Manage report')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        handler = RunReportHandler(filename=path, maxBytes=report_max_bytes, backupCount=backup_count)
+        handler.setFormatter(JsonLinesFormatter())
+        report_queue = queue.SimpleQueue()
+        self.logger.addHandler(ReportQueueHandler(report_queue))
+        self.listener = logging.handlers.QueueListener(report_queue, handler)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+        self.run = None
+
+    # Start a new run; records are grouped by the run's start time
+    def start(self):
+        self.run = datetime.datetime.now().isoformat(timespec='seconds')
+        self.logger.info(None)
+
+    def item(self, stage, action, name, **fields):
+        self.logger.info({'run': self.run, 'instance': current_instance.get(), 'stage': stage, 'action': action, 'name': name,
+                          'dry_run': args.dry_run == 'dry_run', **fields})
+        logger.debug('%s: %s - %s', stage, action, name)
+
+
+run_report = RunReport(report_file)
 
-client = Client(host=host,
-                username=username,
-                password=password)
+
+# Minimal metrics registry rendered in the Prometheus text exposition format.
+# Counters and gauges hold one value per label set, histograms hold cumulative bucket counts plus a sum and count.
+# Values are updated from worker threads (parallel API calls, file moves) so every update takes the lock.
+class Metrics:
+    stage_buckets = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+    api_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.define('qbit_manage_stage_duration_seconds', 'histogram', 'Time spent in each stage of a run.', self.stage_buckets)
+        self.define('qbit_manage_api_request_duration_seconds', 'histogram', 'qBittorrent Web API response time per endpoint.', self.api_buckets)
+        self.define('qbit_manage_api_requests_total', 'counter', 'qBittorrent Web API requests per endpoint and HTTP status.')
+        self.define('qbit_manage_api_sent_bytes_total', 'counter', 'Request body bytes sent to the qBittorrent Web API per endpoint.')
+        self.define('qbit_manage_api_received_bytes_total', 'counter', 'Response body bytes received from the qBittorrent Web API per endpoint.')
+        self.define('qbit_manage_actions_total', 'counter', 'Torrents and files acted on (or that would be with --dry-run) per action.')
+        self.define('qbit_manage_runs_total', 'counter', 'Completed runs.')
+        self.define('qbit_manage_run_errors_total', 'counter', 'Runs aborted because qBittorrent could not be reached.')
+        self.define('qbit_manage_last_run_duration_seconds', 'gauge', 'Duration of the last completed run.')
+        self.define('qbit_manage_last_run_timestamp_seconds', 'gauge', 'Unix time the last run completed.')
+
+    def define(self, name, kind, description, buckets=None):
+        self.metrics[name] = {'type': kind, 'help': description, 'buckets': buckets, 'values': {}}
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.metrics[name]['values']
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.metrics[name]['values'][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            metric = self.metrics[name]
+            counts = metric['values'].get(key)
+            if counts is None:
+                counts = metric['values'][key] = [0] * len(metric['buckets']) + [0, 0]
+            for i, bound in enumerate(metric['buckets']):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    # Time the body of the with block as one run of `stage`. The body of a stage that is not enabled still runs
+    # but is not timed, so it doesn't add near-zero samples to the histogram.
+    @contextlib.contextmanager
+    def stage(self, stage, enabled=True):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if enabled:
+                self.observe('qbit_manage_stage_duration_seconds', time.perf_counter() - start, stage=stage, instance=current_instance.get())
+
+    def action(self, action, count=1):
+        if count:
+            self.inc('qbit_manage_actions_total', count, action=action, dry_run=str(args.dry_run == 'dry_run').lower(),
+                     instance=current_instance.get())
+
+    def finish_run(self, duration):
+        self.inc('qbit_manage_runs_total')
+        self.set('qbit_manage_last_run_duration_seconds', duration)
+        self.set('qbit_manage_last_run_timestamp_seconds', time.time())
+
+    # requests response hook installed on the qBittorrent client; records every Web API call
+    def observe_response(self, response, *args, instance='', **kwargs):
+        start = time.perf_counter()
+        received = len(response.content)
+        elapsed = response.elapsed.total_seconds() + time.perf_counter() - start
+        path = urllib.parse.urlsplit(response.url).path
+        endpoint = path.split('/api/v2/', 1)[-1]
+        body = response.request.body
+        sent = len(body) if isinstance(body, (bytes, str)) else 0
+        self.inc('qbit_manage_api_requests_total', endpoint=endpoint, code=str(response.status_code), instance=instance)
+        self.inc('qbit_manage_api_sent_bytes_total', sent, endpoint=endpoint, instance=instance)
+        self.inc('qbit_manage_api_received_bytes_total', received, endpoint=endpoint, instance=instance)
+        self.observe('qbit_manage_api_request_duration_seconds', elapsed, endpoint=endpoint, instance=instance)
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+    def _labels(self, labels):
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{name}="{self._escape(value)}"' for name, value in labels) + '}'
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, metric in self.metrics.items():
+                lines.append(f'# HELP {name} {metric["help"]}')
+                lines.append(f'# TYPE {name} {metric["type"]}')
+                for labels, value in sorted(metric['values'].items()):
+                    if metric['type'] != 'histogram':
+                        lines.append(f'{name}{self._labels(labels)} {value}')
+                        continue
+                    for bound, count in zip(metric['buckets'] + ('+Inf',), value[:-2] + [value[-1]]):
+                        le = bound if bound == '+Inf' else f'{bound:g}'
+                        lines.append(f'{name}_bucket{self._labels(labels + (("le", le),))} {count}')
+                    lines.append(f'{name}_sum{self._labels(labels)} {value[-2]}')
+                    lines.append(f'{name}_count{self._labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    # Write the metrics for the node_exporter textfile collector. The file is replaced atomically so the
+    # collector never reads a partly written file.
+    def write_textfile(self, path):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    # Serve the metrics on http://host:port/metrics from a background thread (daemon mode)
+    def serve(self, port, host=''):
+        import http.server
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+metrics = Metrics()
+metrics_cfg = cfg.get('metrics') or {}
+
+# One qBittorrent instance from the `qbt` config.
+# Each instance has its own client, may override any `directory:` entry and keeps its state (file index,
+# recheck queue) in its own SQLite database; with a single instance the database is `config.db` as before.
+# Number of parallel requests used for per-torrent lookups (trackers, files) is set per instance by
+# `max_workers`. The HTTP connection pool is sized to match so every worker keeps its own keep-alive connection,
+# and failed requests are retried with an exponential backoff.
+# The client is created on first use and logs in on its first API call, so runs that don't need the WebUI
+# never import qbittorrentapi or connect.
+class Instance:
+    def __init__(self, qbt_cfg):
+        self.qbt_cfg = qbt_cfg
+        self.name = str(qbt_cfg.get('name', qbt_cfg['host']))
+        self.max_workers = qbt_cfg.get('max_workers', 8)
+        self.directory = dict(cfg.get('directory') or {}, **(qbt_cfg.get('directory') or {}))
+        if len(qbt_cfgs) == 1:
+            self.db_file = db_file
+        else:
+            self.db_file = os.path.splitext(args.config)[0] + '.' + re.sub(r'[^\w.-]+', '_', self.name) + '.db'
+
+    @functools.cached_property
+    def client(self):
+        import urllib3
+        from urllib3.util.retry import Retry
+        from qbittorrentapi import Client
+        urllib3.disable_warnings()
+        qbt_cfg = self.qbt_cfg
+        return Client(host=qbt_cfg['host'],
+                      username=qbt_cfg.get('user', ''),
+                      password=qbt_cfg.get('pass', ''),
+                      HTTPADAPTER_ARGS={'pool_connections': self.max_workers,
+                                        'pool_maxsize': self.max_workers,
+                                        'max_retries': Retry(total=3,
+                                                             backoff_factor=0.5,
+                                                             status_forcelist={500, 502, 503, 504},
+                                                             allowed_methods=None,
+                                                             raise_on_status=False)},
+                      REQUESTS_ARGS={'hooks': {'response': functools.partial(metrics.observe_response, instance=self.name)}})
+
+
+instances = [Instance(qbt_cfg) for qbt_cfg in qbt_cfgs]
+if len({instance.name for instance in instances}) < len(instances):
+    parser.error('qbt instances need a unique name')
+
+
+# Exception raised when a qBittorrent instance can't be reached. It can only be raised once a client exists,
+# so before that an empty tuple (which catches nothing) is returned instead of importing qbittorrentapi.
+def connection_errors():
+    qbittorrentapi = sys.modules.get('qbittorrentapi')
+    return qbittorrentapi.APIConnectionError if qbittorrentapi else ()
+
+
+# Run func over items using up to `workers` threads. Results are returned in the same order as items.
+def fetch_parallel(func, items, workers):
+    items = list(items)
+    if len(items) <= 1 or workers <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
 
 
 def trunc_val(s, d, n=3):
     return d.join(s.split(d, n)[:n])
 
 
+# Minimal bencode decoder for .torrent files. Strings are returned as bytes.
+def bdecode(data):
+    def decode(i):
+        c = data[i:i + 1]
+        if c == b'i':
+            end = data.index(b'e', i)
+            return int(data[i + 1:end]), end + 1
+        if c == b'l':
+            i += 1
+            items = []
+            while data[i:i + 1] != b'e':
+                item, i = decode(i)
+                items.append(item)
+            return items, i + 1
+        if c == b'd':
+            i += 1
+            items = {}
+            while data[i:i + 1] != b'e':
+                key, i = decode(i)
+                items[key], i = decode(i)
+            return items, i + 1
+        if c.isdigit():
+            colon = data.index(b':', i)
+            start = colon + 1
+            end = start + int(data[i:colon])
+            if end > len(data):
+                raise ValueError('truncated string')
+            return data[start:end], end
+        raise ValueError(f'invalid bencode at offset {i}')
+    value, end = decode(0)
+    if end != len(data):
+        raise ValueError('trailing data after bencoded value')
+    return value
+
+
+# Return the content name and total size from the info dictionary of a .torrent file
+def get_torrent_file_info(path):
+    with open(path, 'rb') as f:
+        info = bdecode(f.read())[b'info']
+    name = info.get(b'name.utf-8', info[b'name']).decode('utf-8', errors='replace')
+    if b'length' in info:
+        size = info[b'length']
+    elif b'files' in info:
+        size = sum(file[b'length'] for file in info[b'files'])
+    else:
+        # v2 only torrent: sizes are stored in the leaves of the file tree
+        def tree_size(tree):
+            return sum(node[b''][b'length'] if b'' in node else tree_size(node) for node in tree.values())
+        size = tree_size(info[b'file tree'])
+    return name, size
+
+
+def normalize_name(name):
+    return re.sub(r'[\W_]+', '', name.lower())
+
+
+# Compiled form of the `cat:` table.
+# Full paths are stored in a trie of path components and the longest matching path wins, so nested
+# save paths resolve deterministically. When no full path is a prefix of the save path, every value
+# (full paths included, e.g. /data/torrents/Movies inside /mnt/data/torrents/Movies) is tried in config
+# order with the old substring test. Results are memoized per save_path, and paths without a category are
+# collected and logged once by report_unmatched() instead of a warning per torrent.
+class CategoryMatcher:
+    def __init__(self, cat):
+        self._trie = {}
+        self._keywords = []
+        for category, path in (cat or {}).items():
+            path = str(path)
+            if path.startswith(('/', '\\')) or path[1:3] in (':/', ':\\'):
+                node = self._trie
+                for part in self._split(path):
+                    node = node.setdefault(part, {})
+                node.setdefault(None, category)
+            self._keywords.append((category, path))
+        self._cache = {}
+        self.unmatched = set()
+
+    @staticmethod
+    def _split(path):
+        return [part for part in path.replace('\\', '/').split('/') if part]
+
+    def match(self, path):
+        if path in self._cache:
+            return self._cache[path]
+        node = self._trie
+        category = node.get(None)
+        for part in self._split(path):
+            node = node.get(part)
+            if node is None:
+                break
+            category = node.get(None, category)
+        if category is None:
+            category = next((c for c, keyword in self._keywords if keyword in path), None)
+        if category is None:
+            category = ''
+            self.unmatched.add(path)
+        self._cache[path] = category
+        return category
+
+    def report_unmatched(self):
+        if self.unmatched:
+            logger.warning(f'No categories matched {len(self.unmatched)} save path(s). Check your config.yml file. - Setting category to NULL'
+                           f'\n - ' + '\n - '.join(sorted(self.unmatched)))
+            self.unmatched.clear()
+
+
+category_matcher = CategoryMatcher(cfg['cat'])
+
+
 def get_category(path):
-    cat_path = cfg["cat"]
-    for i, f in cat_path.items():
-        if f in path:
-            category = i
-            return category
-    category = ''
-    logger.warning('No categories matched. Check your config.yml file. - Setting category to NULL')
-    return category
+    return category_matcher.match(path)
 
 
-def get_tags(urls):
-    tag_path = cfg['tags']
-    for i, f in tag_path.items():
+# Compiled form of the `tags:` table.
+# All tracker keywords are loaded into one Aho-Corasick automaton so a URL is scanned once no matter
+# how many keywords there are, and the outcome is memoized per announce URL (torrents from the same
+# tracker share it). The first keyword in config order that matches any URL wins, like the original
+# nested loop; keywords mapped to an empty tag are ignored. Trackers without a tag are counted in
+# `unmatched` and logged once by report_unmatched().
+class TagMatcher:
+    def __init__(self, tags):
+        self.rules = [(str(keyword), tag) for keyword, tag in (tags or {}).items() if tag]
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [None]
+        for index, (keyword, tag) in enumerate(self.rules):
+            node = 0
+            for char in keyword:
+                if char not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(None)
+                    self._goto[node][char] = len(self._goto) - 1
+                node = self._goto[node][char]
+            if self._out[node] is None:
+                self._out[node] = index
+        # Breadth first pass to set the failure links and merge the matches reachable through them
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                inherited = self._out[self._fail[child]]
+                if inherited is not None and (self._out[child] is None or inherited < self._out[child]):
+                    self._out[child] = inherited
+                queue.append(child)
+        self._cache = {}
+        self.unmatched = Counter()
+
+    # Index of the first rule (in config order) whose keyword appears in url, or None
+    def _match_url(self, url):
+        if url in self._cache:
+            return self._cache[url]
+        best = None
+        node = 0
+        for char in url:
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            index = self._out[node]
+            if index is not None and (best is None or index < best):
+                best = index
+                if best == 0:
+                    break
+        self._cache[url] = best
+        return best
+
+    def match(self, urls):
+        best = None
+        best_url = None
         for url in urls:
-            if i in url:
-                tag = f
-                if tag: return tag,trunc_val(url, '/')
-    tag = ''
-    logger.warning('No tags matched. Check your config.yml file. Setting tag to NULL')
-    return tag
-
-def remove_empty_directories(pathlib_root_dir):
-  # list all directories recursively and sort them by path,
-  # longest first
-  L = sorted(
-      pathlib_root_dir.glob("**"),
-      key=lambda p: len(str(p)),
-      reverse=True,
-  )
-  for pdir in L:
-    try:
-      pdir.rmdir()  # remove directory if empty
-    except OSError:
-      continue  # catch and continue if non-empty       
-
-# Will create a 2D Dictionary with the torrent name as the key
-# torrentdict = {'TorrentName1' : {'Category':'TV', 'save_path':'/data/torrents/TV', 'count':1, 'msg':'[]'},
-#                'TorrentName2' : {'Category':'Movies', 'save_path':'/data/torrents/Movies'}, 'count':2, 'msg':'[]'}
-def get_torrent_info(t_list):
-    torrentdict = {}
-    for torrent in t_list:
-        save_path = torrent.save_path
-        category = get_category(save_path)
-        is_complete = False
-        if torrent.name in torrentdict:
-            t_count = torrentdict[torrent.name]['count'] + 1
-            msg_list = torrentdict[torrent.name]['msg']
-            is_complete = True if torrentdict[torrent.name]['is_complete'] == True else torrent.state_enum.is_complete
+            index = self._match_url(url)
+            if index is not None and (best is None or index < best):
+                best, best_url = index, url
+        if best is None:
+            return None
+        return self.rules[best][1], trunc_val(best_url, '/')
+
+    def report_unmatched(self):
+        if self.unmatched:
+            logger.warning(f'No tags matched {sum(self.unmatched.values())} torrent(s). Check your config.yml file. Setting tag to NULL'
+                           + ''.join(f'\n - {url or "(no tracker)"}: {count}' for url, count in self.unmatched.most_common()))
+            self.unmatched.clear()
+
+
+tag_matcher = TagMatcher(cfg['tags'])
+
+
+def get_tags(urls):
+    match = tag_matcher.match(urls)
+    if match:
+        return match
+    tag_matcher.unmatched[trunc_val(urls[0], '/') if urls else ''] += 1
+    return '', ''
+
+
+# Tracker messages that mark a torrent as unregistered, from the `unregistered:` list.
+# Every entry is a regular expression searched in the message; they are compiled into a single pattern.
+unregistered_patterns = cfg.get('unregistered') or ['Unregistered torrent', 'Torrent is not found', 'Torrent not registered']
+try:
+    unregistered_re = re.compile('|'.join(unregistered_group(pattern) for pattern in unregistered_patterns))
+except re.error as e:
+    parser.error(f'invalid unregistered pattern in {args.config}: {e}')
+
+# Remove the directories in `dirs` and their parents up to (not including) `top` if they are empty.
+# Deepest directories are tried first; once a directory can't be removed none of its parents are tried.
+def remove_empty_directories(dirs, top):
+    top = os.path.normpath(top)
+    candidates = set()
+    for path in dirs:
+        path = os.path.normpath(path)
+        while path != top and path.startswith(top + os.sep) and path not in candidates:
+            candidates.add(path)
+            path = os.path.dirname(path)
+    kept = set()
+    for path in sorted(candidates, key=lambda p: p.count(os.sep), reverse=True):
+        if path in kept:
+            continue
+        try:
+            os.rmdir(path)
+        except OSError:
+            kept.add(os.path.dirname(path))
+
+
+# Move every (src, dest) pair using `workers` threads.
+# Destination directories are created once up front. A plain rename is used when src and dest are on the
+# same filesystem and shutil.move (copy + delete) otherwise. Returns the list of pairs that failed to move.
+def move_files(moves, workers=4):
+    import shutil
+    for dest_path in sorted({os.path.dirname(dest) for src, dest in moves}):
+        os.makedirs(dest_path, exist_ok=True)
+
+    def move(pair):
+        src, dest = pair
+        try:
+            try:
+                os.rename(src, dest)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.move(src, dest)
+        except OSError as e:
+            logger.warning(f'Unable to move {src} to {dest}: {e.strerror}')
+            return pair
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        return [pair for pair in executor.map(move, moves) if pair]
+
+
+# Compact per-torrent row kept by TorrentStore. Category and save path strings are interned so the many
+# torrents sharing a value share one string object.
+class TorrentRecord:
+    __slots__ = ('hash', 'name', 'category', 'save_path', 'is_complete')
+
+    def __init__(self, t_hash, name, category, save_path, is_complete):
+        self.hash = t_hash
+        self.name = name
+        self.category = category
+        self.save_path = save_path
+        self.is_complete = is_complete
+
+
+# Every torrent sharing a name (the original and its cross-seeds), newest first.
+# category and save_path come from the oldest copy and any_complete is set if any copy is complete.
+class NameGroup:
+    __slots__ = ('hashes', 'category', 'save_path', 'any_complete')
+
+    def __init__(self):
+        self.hashes = []
+
+    @property
+    def count(self):
+        return len(self.hashes)
+
+    def aggregate(self, records):
+        rows = [records[t_hash] for t_hash in self.hashes]
+        self.category = rows[-1].category
+        self.save_path = rows[-1].save_path
+        self.any_complete = any(row.is_complete for row in rows)
+
+
+# Table of TorrentRecord keyed by hash with a secondary index of NameGroup keyed by torrent name.
+# Built in one pass over the snapshot (newest torrents first) and then updated in place when a stage removes
+# or adds torrents, so the name aggregates used by rem_unregistered, recheck and cross_seed are only
+# recomputed for the names that changed.
+# With `only` set just the torrents with one of those names are kept.
+# Everything in the table comes from the torrent list; trackers are only fetched by any_working().
+class TorrentStore:
+    def __init__(self, snapshot, only=None):
+        self.snapshot = snapshot
+        self.records = {}
+        self.names = {}
+        self.only = only
+        torrent_list = self._list(snapshot)
+        for torrent in torrent_list:
+            self._add(snapshot, torrent).hashes.append(torrent.hash)
+        for group in self.names.values():
+            group.aggregate(self.records)
+
+    def _list(self, snapshot):
+        torrent_list = snapshot.list(sort='added_on', reverse=True, full=True)
+        if self.only is not None:
+            torrent_list = [torrent for torrent in torrent_list if torrent.name in self.only]
+        return torrent_list
+
+    def _add(self, snapshot, torrent):
+        intern = sys.intern
+        self.records[torrent.hash] = TorrentRecord(torrent.hash, torrent.name,
+                                                   intern(get_category(torrent.save_path)),
+                                                   intern(torrent.save_path),
+                                                   torrent.state_enum.is_complete)
+        group = self.names.get(torrent.name)
+        if group is None:
+            group = self.names[torrent.name] = NameGroup()
+        return group
+
+    # Bring the table in line with the snapshot after torrents were added or removed behind its back.
+    # New torrents are the newest ones, so they go to the front of their name group.
+    def sync(self, snapshot):
+        torrent_list = self._list(snapshot)
+        current = {torrent.hash for torrent in torrent_list}
+        for t_hash in [t_hash for t_hash in self.records if t_hash not in current]:
+            self.remove(t_hash)
+        added = [torrent for torrent in torrent_list if torrent.hash not in self.records]
+        groups = set()
+        for torrent in reversed(added):
+            group = self._add(snapshot, torrent)
+            group.hashes.insert(0, torrent.hash)
+            groups.add(torrent.name)
+        for name in groups:
+            self.names[name].aggregate(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, t_hash):
+        return self.records.get(t_hash)
+
+    def group(self, name):
+        return self.names[name]
+
+    # True if the first http tracker of any copy of `name` reports no error. Only rem_unregistered needs
+    # tracker status, so the trackers of the copies are fetched here (or taken from the snapshot's cache).
+    def any_working(self, name):
+        torrents = [torrent for torrent in map(self.snapshot.get, self.names[name].hashes) if torrent is not None]
+        self.snapshot.prefetch_trackers(torrents)
+        return any(next((x.msg for x in self.snapshot.trackers(torrent) if x.url.startswith('http')), None) == ''
+                   for torrent in torrents)
+
+    def remove(self, t_hash):
+        record = self.records.get(t_hash)
+        if record is None:
+            return
+        group = self.names[record.name]
+        group.hashes.remove(t_hash)
+        if group.hashes:
+            group.aggregate(self.records)
         else:
-            t_count = 1
-            msg_list = []
-            is_complete = torrent.state_enum.is_complete
-        msg = [x.msg for x in torrent.trackers if x.url.startswith('http')][0]
-        msg_list.append(msg)
-        torrentattr = {'Category': category, 'save_path': save_path, 'count': t_count, 'msg': msg_list, 'is_complete': is_complete}
-        torrentdict[torrent.name] = torrentattr
-    return torrentdict
-
-# Function used to recheck paused torrents sorted by size and resume torrents that are completed 
-def recheck():
-    if args.cross_seed == 'cross_seed' or args.manage == 'manage' or args.recheck == 'recheck':
-        #sort by size and paused
-        torrent_sorted_list = client.torrents.info(status_filter='paused',sort='size')
-        torrentdict = get_torrent_info(client.torrents.info(sort='added_on',reverse=True))
-        for torrent in torrent_sorted_list:
-            new_tag,t_url = get_tags([x.url for x in torrent.trackers if x.url.startswith('http')])
-            if torrent.tags == '': torrent.add_tags(tags=new_tag)
-            #Resume torrent if completed
-            if torrent.progress == 1: 
-                if args.dry_run == 'dry_run': 
-                    logger.dryrun(f'\n - Not Resuming {new_tag} - {torrent.name}')
-                else:
-                    logger.info(f'\n - Resuming {new_tag} - {torrent.name}')
-                    torrent.resume()
-            #Recheck
-            elif torrent.progress == 0 and torrentdict[torrent.name]['is_complete']:
-                if args.dry_run == 'dry_run':
-                    logger.dryrun(f'\n - Not Rechecking {new_tag} - {torrent.name}')
-                else:
-                    logger.info(f'\n - Rechecking {new_tag} - {torrent.name}')
-                    torrent.recheck()
+            del self.names[record.name]
+        del self.records[t_hash]
+
+
+# Run-scoped view of qBittorrent shared by every stage in run().
+# The torrent list, each torrent's trackers and the TorrentStore are fetched/built once
+# and every stage sorts or filters them locally instead of asking the WebUI again.
+# Changes a stage makes (new category/tags, deleted torrents) are folded back into the view
+# so later stages see the same state they would have seen after a fresh fetch.
+# In daemon mode the view is backed by a SyncTable and list() only returns the torrents that changed
+# since the last tick; list(full=True) and store() still cover every torrent.
+# With `hashes` (--hash) list() only returns those torrents, and only they are fetched until a stage needs
+# every torrent (e.g. to find the cross-seeds of an unregistered torrent).
+# `left` and `failed` record the outcome of the run on the snapshot's instance.
+class TorrentSnapshot:
+    def __init__(self, instance, table=None, changed=None, hashes=None):
+        self.instance = instance
+        self.table = table
+        self.changed = changed if hashes is None else {t_hash.lower() for t_hash in hashes}
+        self.hashes = None if hashes is None else self.changed
+        self._selected = None
+        self.left = []
+        self.failed = False
+        self._torrents = table.torrents if table else None
+        self._trackers = table.trackers if table else {}
+        self._store = None
+        self._stale = False
+        self._index = None
+        self.api_calls = 0
+        self.saved_calls = 0
+
+    @property
+    def client(self):
+        return self.instance.client
+
+    def _load(self, full=True):
+        if self._torrents is None:
+            if not full and self.hashes is not None:
+                if self._selected is None:
+                    self._selected = {torrent.hash: torrent for torrent in self.client.torrents.info(torrent_hashes=list(self.hashes))}
+                    self.api_calls += 1
+                    if len(self._selected) < len(self.hashes):
+                        logger.warning(f'{len(self.hashes) - len(self._selected)} of the given hash(es) not found in qBittorrent.')
+                return self._selected
+            self._torrents = {torrent.hash: torrent for torrent in self.client.torrents.info()}
+            self.api_calls += 1
+            # Keep the already fetched (and maybe updated) objects of the selected torrents
+            if self._selected:
+                self._torrents.update((t_hash, torrent) for t_hash, torrent in self._selected.items() if t_hash in self._torrents)
+        return self._torrents
+
+    # Local equivalent of client.torrents.info(sort=..., reverse=...)
+    def list(self, sort=None, reverse=False, full=False):
+        if self._torrents is not None:
+            self.saved_calls += 1
+        torrents = self._load(full)
+        if self.changed is not None and not full:
+            torrents = [torrents[h] for h in self.changed if h in torrents]
+        else:
+            torrents = list(torrents.values())
+        if sort:
+            torrents.sort(key=lambda t: t[sort], reverse=reverse)
+        elif reverse:
+            torrents.reverse()
+        return tuple(torrents)
+
+    def get(self, t_hash):
+        return self._load().get(t_hash)
+
+    # Fetch the trackers of every torrent not cached yet in parallel
+    def prefetch_trackers(self, torrents):
+        missing = [t for t in torrents if t.hash not in self._trackers]
+        for torrent, trackers in zip(missing, fetch_parallel(lambda t: tuple(t.trackers), missing, self.instance.max_workers)):
+            self._trackers[torrent.hash] = trackers
+        self.api_calls += len(missing)
+
+    def trackers(self, torrent):
+        trackers = self._trackers.get(torrent.hash)
+        if trackers is None:
+            trackers = self._trackers[torrent.hash] = tuple(torrent.trackers)
+            self.api_calls += 1
+        else:
+            self.saved_calls += 1
+        return trackers
+
+    # With --hash the store only needs the copies of the selected torrents, unless cross_seed looks up others
+    def store(self):
+        if self._store is None:
+            only = None
+            if self.hashes is not None and args.cross_seed != 'cross_seed':
+                only = {torrent.name for torrent in self.list()}
+            self._store = TorrentStore(self, only)
+        elif self._stale:
+            self._store.sync(self)
+        self._stale = False
+        return self._store
+
+    # Lookup tables from (content name, total size) and from the normalized content name to the
+    # torrent name used as the TorrentStore name key
+    def content_index(self):
+        if self._index is None:
+            by_content = {}
+            by_name = {}
+            for torrent in self.list(sort='added_on', reverse=True, full=True):
+                by_content.setdefault((torrent.name, torrent.get('total_size', torrent.size)), torrent.name)
+                by_name.setdefault(normalize_name(torrent.name), torrent.name)
+            self._index = by_content, by_name
+        return self._index
+
+    # Record a change made through the API so later stages don't need to re-fetch the torrent
+    def update(self, torrent, **fields):
+        torrent.update(fields)
+
+    # Torrents were added behind the snapshot's back; re-list them on next use (trackers stay cached)
+    def refresh(self):
+        if self.table:
+            self.changed |= self.table.update(pending=True)
+            self.api_calls += 1
+        else:
+            self._torrents = None
+            self._selected = None
+        self._stale = True
+        self._index = None
+
+    def remove(self, torrent):
+        for torrents in (self._torrents, self._selected):
+            if torrents is not None:
+                torrents.pop(torrent.hash, None)
+        self._trackers.pop(torrent.hash, None)
+        if self._store is not None:
+            self._store.remove(torrent.hash)
+        self._index = None
+
+    def log_stats(self):
+        if self.api_calls or self.saved_calls:
+            logger.info(f'Torrent snapshot made {self.api_calls} API calls and saved {self.saved_calls} round trips.')
+
+
+# In-memory torrent table kept current from qBittorrent's rid based sync/maindata deltas.
+# update() applies one delta and returns the hashes that were added or changed since the previous call.
+# A delta read outside a daemon tick's main pass (by the cross-seed watcher or a refresh after adding torrents)
+# is only seen by the cross-seed and recheck rules, so its hashes are also kept in `pending` (update(pending=True))
+# and changes() hands them to the next tick together with its own delta.
+# Cached trackers are dropped when a delta touches a field that follows the tracker status, so they are
+# re-read on next use; speed and transfer counters changing on active torrents keep the cache.
+# A tracker can go from one error to another (e.g. timed out to unregistered) without any of those fields
+# changing, so the trackers of torrents without a working tracker (`tracker` is '') are also dropped once they
+# have been cached for `tracker_ttl` seconds, and the torrent is reported as changed to be looked at again.
+class SyncTable:
+    tracker_fields = {'tracker', 'trackers_count', 'state'}
+    tracker_ttl = 3600
+
+    def __init__(self, client):
+        self.client = client
+        self.rid = 0
+        self.torrents = {}
+        self.trackers = {}
+        self.cached_at = {}
+        self.pending = set()
+
+    def update(self, pending=False):
+        from qbittorrentapi import TorrentDictionary
+        maindata = self.client.sync.maindata(rid=self.rid)
+        self.rid = maindata.get('rid', 0)
+        if maindata.get('full_update'):
+            self.torrents.clear()
+            self.trackers.clear()
+        changed = set()
+        for t_hash, fields in maindata.get('torrents', {}).items():
+            if t_hash in self.torrents:
+                self.torrents[t_hash].update(fields)
+                if not self.tracker_fields.isdisjoint(fields):
+                    self.trackers.pop(t_hash, None)
+            else:
+                self.torrents[t_hash] = TorrentDictionary(data=dict(fields, hash=t_hash), client=self.client)
+            changed.add(t_hash)
+        for t_hash in maindata.get('torrents_removed', []):
+            self.torrents.pop(t_hash, None)
+            self.trackers.pop(t_hash, None)
+            changed.discard(t_hash)
+            self.pending.discard(t_hash)
+        now = time.monotonic()
+        for t_hash in self.trackers.keys() - self.cached_at.keys():
+            self.cached_at[t_hash] = now
+        for t_hash, cached_at in list(self.cached_at.items()):
+            if t_hash not in self.trackers:
+                del self.cached_at[t_hash]
+            elif now - cached_at >= self.tracker_ttl and self.torrents.get(t_hash, {}).get('tracker') == '':
+                del self.trackers[t_hash]
+                del self.cached_at[t_hash]
+                changed.add(t_hash)
+        if pending:
+            self.pending |= changed
+        return changed
+
+    # Hashes changed since the previous tick, including the ones consumed in between
+    def changes(self):
+        changed = self.update() | self.pending
+        self.pending = set()
+        return changed
+
+    def reset(self):
+        self.rid = 0
+
+
+# Collects the write actions decided by a stage and sends them as multi-hash requests.
+# Actions are grouped by (action, argument), e.g. ('set_category', 'tv'), and each group is sent in chunks
+# of `chunk_size` hashes when the stage calls flush(). In dry-run mode flush() only logs the grouped plan.
+class WriteBatcher:
+    actions = {
+        'set_category': lambda client, arg, hashes: client.torrents_set_category(category=arg, torrent_hashes=hashes),
+        'add_tags': lambda client, arg, hashes: client.torrents_add_tags(tags=arg, torrent_hashes=hashes),
+        'resume': lambda client, arg, hashes: client.torrents_resume(torrent_hashes=hashes),
+        'recheck': lambda client, arg, hashes: client.torrents_recheck(torrent_hashes=hashes),
+        'delete': lambda client, arg, hashes: client.torrents_delete(delete_files=arg, torrent_hashes=hashes),
+    }
+
+    def __init__(self, instance, chunk_size=500):
+        self.instance = instance
+        self.chunk_size = chunk_size
+        self.pending = {}
+
+    def queue(self, action, torrent, arg=None):
+        self.pending.setdefault((action, arg), {})[torrent.hash] = None
+
+    @staticmethod
+    def describe(action, arg):
+        return {
+            'set_category': f'set category {arg}',
+            'add_tags': f'add tag {arg}',
+            'resume': 'resume',
+            'recheck': 'recheck',
+            'delete': 'delete .torrent AND content files' if arg else 'delete .torrent but not content files',
+        }[action]
+
+    def flush(self):
+        pending, self.pending = self.pending, {}
+        for (action, arg), hashes in pending.items():
+            hashes = list(hashes)
+            chunks = [hashes[i:i + self.chunk_size] for i in range(0, len(hashes), self.chunk_size)]
+            metrics.action('delete_with_data' if action == 'delete' and arg else action, len(hashes))
+            if args.dry_run == 'dry_run':
+                logger.dryrun(f'Would {self.describe(action, arg)} on {len(hashes)} torrent(s) in {len(chunks)} request(s).')
+                continue
+            for chunk in chunks:
+                self.actions[action](self.instance.client, arg, chunk)
+            logger.debug(f'Sent {self.describe(action, arg)} for {len(hashes)} torrent(s) in {len(chunks)} request(s).')
+
+
+# Runs rechecks with at most `max_concurrent` torrents checking at the same time on each save path root.
+# Roots and their own limits are set under `recheck: roots:`, torrents outside them share the default limit.
+# Waiting and running rechecks are kept in the SQLite database, so an interrupted run picks up where it left off.
+# step() looks at the current torrent states: torrents that reached 100% are resumed, finished or vanished
+# ones leave the queue and the freed slots are given to the next (smallest) queued torrents.
+# A started recheck is marked `checking` once qBittorrent is seen checking it. When it is paused below 100% after
+# that, or still paused at 0% `start_timeout` seconds after it was sent (a check too quick to be seen), the check
+# is over and the data is incomplete, e.g. a cross-seed whose files are not at the save path.
+class RecheckScheduler:
+    def __init__(self, client, path):
+        import sqlite3
+        recheck_cfg = cfg.get('recheck') or {}
+        self.client = client
+        self.max_concurrent = recheck_cfg.get('max_concurrent', 1)
+        self.roots = {os.path.join(root, ''): limit for root, limit in (recheck_cfg.get('roots') or {}).items()}
+        self.poll_interval = recheck_cfg.get('poll_interval', 30)
+        self.start_timeout = recheck_cfg.get('start_timeout', 300)
+        self.wait = recheck_cfg.get('wait', False)
+        self.max_wait = recheck_cfg.get('max_wait', 6 * 3600)
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS rechecks (hash TEXT PRIMARY KEY, name TEXT NOT NULL, root TEXT NOT NULL,'
+                        ' size INTEGER NOT NULL, status TEXT NOT NULL, started REAL)')
+        # Queues saved by older versions have no start time
+        if 'started' not in [column[1] for column in self.db.execute('PRAGMA table_info(rechecks)')]:
+            with self.db:
+                self.db.execute('ALTER TABLE rechecks ADD COLUMN started REAL')
+
+    def root(self, save_path):
+        save_path = os.path.join(save_path, '')
+        return max((root for root in self.roots if save_path.startswith(root)), key=len, default='')
+
+    def enqueue(self, torrent):
+        with self.db:
+            self.db.execute('INSERT OR IGNORE INTO rechecks VALUES (?, ?, ?, ?, ?, NULL)',
+                            (torrent.hash, torrent.name, self.root(torrent.save_path), torrent.size, 'queued'))
+
+    # Advance the queue using `torrents` (hash -> torrent). Returns the number of torrents still queued or checking.
+    def step(self, torrents, batcher, now=None):
+        now = time.time() if now is None else now
+        rows = self.db.execute('SELECT hash, name, root, status, started FROM rechecks ORDER BY size').fetchall()
+        running = Counter()
+        started = []
+        checking = []
+        finished = []
+        resumed = 0
+        for t_hash, name, root, status, started_at in rows:
+            torrent = torrents.get(t_hash)
+            if torrent is None:
+                finished.append(t_hash)
+            elif status == 'queued':
+                if not torrent.state_enum.is_paused:
+                    finished.append(t_hash)
+            elif torrent.state_enum.is_checking:
+                if status == 'started':
+                    checking.append(t_hash)
+                running[root] += 1
+            elif torrent.progress == 1:
+                run_report.item('recheck', 'resume', name)
+                batcher.queue('resume', torrent)
+                finished.append(t_hash)
+                resumed += 1
+            elif (torrent.progress > 0 or not torrent.state_enum.is_paused or status == 'checking'
+                  or now - (started_at or 0) >= self.start_timeout):
+                run_report.item('recheck', 'recheck_incomplete', name, progress=torrent.progress)
+                finished.append(t_hash)
+            else:
+                # Recheck was sent but qBittorrent has not started it yet
+                running[root] += 1
+        for t_hash, name, root, status, started_at in rows:
+            if status == 'queued' and t_hash not in finished and running[root] < self.roots.get(root, self.max_concurrent):
+                run_report.item('recheck', 'recheck', name)
+                batcher.queue('recheck', torrents[t_hash])
+                started.append(t_hash)
+                running[root] += 1
+        batcher.flush()
+        with self.db:
+            self.db.executemany("UPDATE rechecks SET status = 'started', started = ? WHERE hash = ?", [(now, t_hash) for t_hash in started])
+            self.db.executemany("UPDATE rechecks SET status = 'checking' WHERE hash = ?", [(t_hash,) for t_hash in checking])
+            self.db.executemany('DELETE FROM rechecks WHERE hash = ?', [(t_hash,) for t_hash in finished])
+        if started or finished:
+            logger.info(f'Started {len(started)} recheck(s) and resumed {resumed} rechecked torrent(s).'
+                        f' {len(rows) - len(finished)} torrent(s) queued or checking.')
+        return len(rows) - len(finished)
+
+    # Advance the queue once per run (or daemon tick); what is left in the queue is picked up by the next run.
+    # With `recheck: wait: true` a run without --daemon keeps polling until every recheck is done or `max_wait`
+    # seconds have passed.
+    def process(self, snapshot, batcher):
+        deadline = time.monotonic() + self.max_wait
+        remaining = self.step({torrent.hash: torrent for torrent in snapshot.list(full=True)}, batcher)
+        while remaining and self.wait and snapshot.table is None:
+            if time.monotonic() + self.poll_interval > deadline:
+                logger.warning(f'{remaining} torrent(s) still waiting for recheck after {self.max_wait} seconds.'
+                               ' They will be continued on the next run.')
+                break
+            logger.debug(f'{remaining} torrent(s) waiting for recheck. Checking again in {self.poll_interval} seconds.')
+            time.sleep(self.poll_interval)
+            hashes = [t_hash for t_hash, in self.db.execute('SELECT hash FROM rechecks')]
+            remaining = self.step({torrent.hash: torrent for torrent in self.client.torrents.info(torrent_hashes=hashes)}, batcher)
+
+    def close(self):
+        self.db.close()
+
 
 # Function used to move any torrents from the cross seed directory to the correct save directory
-def cross_seed():
+# Only the given cs_files are processed when set (watch mode), otherwise the whole directory is listed.
+# Returns the files that were left in place because no complete original torrent was found.
+def cross_seed(snapshot, cs_files=None):
+    left = []
     if args.cross_seed == 'cross_seed':
+        import shutil
         # List of categories for all torrents moved
         categories = []
         # Keep track of total torrents moved
         total = 0
         # Used to output the final list torrents moved to output in the log
         torrents_added = ''
+        # .torrent files without a matching torrent or with an incomplete original
+        not_found = 0
+        incomplete = 0
+        # Torrents added to qBittorrent, the snapshot is refreshed once after the loop
+        added = 0
         # Only get torrent files
-        cs_files = [f for f in os.listdir(os.path.join(cfg['directory']['cross_seed'], '')) if f.endswith('torrent')]
-        dir_cs = os.path.join(cfg['directory']['cross_seed'], '')
+        if cs_files is None:
+            cs_files = [f for f in os.listdir(os.path.join(snapshot.instance.directory['cross_seed'], '')) if f.endswith('torrent')]
+        dir_cs = os.path.join(snapshot.instance.directory['cross_seed'], '')
         dir_cs_out = os.path.join(dir_cs,'qbit_manage_added')
         os.makedirs(dir_cs_out,exist_ok=True)
-        torrent_list = client.torrents.info(sort='added_on',reverse=True)
-        torrentdict = get_torrent_info(torrent_list)
+        store = snapshot.store()
+        by_content, by_name = snapshot.content_index()
         for file in cs_files:
-            t_name = file.split(']', 2)[2].split('.torrent')[0]
-            # Substring Key match in dictionary (used because t_name might not match exactly with torrentdict key)
-            # Returned the dictionary of filtered item
-            torrentdict_file = dict(filter(lambda item: t_name in item[0], torrentdict.items()))
-            if torrentdict_file:
-                # Get the exact torrent match name from torrentdict
-                t_name = next(iter(torrentdict_file))
-                category = torrentdict[t_name]['Category']
-                dest = os.path.join(torrentdict[t_name]['save_path'], '')
-                src = os.path.join(dir_cs,file)
+            src = os.path.join(dir_cs,file)
+            try:
+                c_name, c_size = get_torrent_file_info(src)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning(f'Unable to read {file}: {e}. Skipping.')
+                continue
+            # Exact match on the content name and size, then on the normalized content name
+            t_name = by_content.get((c_name, c_size)) or by_name.get(normalize_name(c_name))
+            if t_name:
+                group = store.group(t_name)
+                category = group.category
+                dest = os.path.join(group.save_path, '')
                 dir_cs_out = os.path.join(dir_cs,'qbit_manage_added',file)
-                categories.append(category)
                 if args.dry_run == 'dry_run':
-                    logger.dryrun(f'Not Adding {t_name} to qBittorrent with: '
-                                  f'\n - Category: {category}'
-                                  f'\n - Save_Path: {dest}'
-                                  f'\n - Paused: True')
+                    run_report.item('cross_seed', 'add', t_name, file=file, category=category, save_path=dest)
+                    categories.append(category)
+                    metrics.action('cross_seed_add')
                 else:
-                    if torrentdict[t_name]['is_complete']:
-                        client.torrents.add(torrent_files=src,
-                                            save_path=dest,
-                                            category=category,
-                                            is_paused=True)
+                    if group.any_complete:
+                        snapshot.client.torrents.add(torrent_files=src,
+                                                     save_path=dest,
+                                                     category=category,
+                                                     is_paused=True)
                         shutil.move(src, dir_cs_out)
-                        logger.info(f'Adding {t_name} to qBittorrent with: '
-                                    f'\n - Category: {category}'
-                                    f'\n - Save_Path: {dest}'
-                                    f'\n - Paused: True')
+                        added += 1
+                        run_report.item('cross_seed', 'add', t_name, file=file, category=category, save_path=dest)
+                        categories.append(category)
+                        metrics.action('cross_seed_add')
                     else:
-                        logger.info(f'Found {t_name} in {dir_cs} but original torrent is not complete. Not adding to qBittorrent')
+                        run_report.item('cross_seed', 'original_incomplete', t_name, file=file)
+                        incomplete += 1
+                        left.append(file)
             else:
-                if args.dry_run == 'dry_run':
-                    logger.dryrun(f'{t_name} not found in torrents.')
-                else:
-                    logger.warning(f'{t_name} not found in torrents.')
+                run_report.item('cross_seed', 'not_found', c_name, file=file)
+                not_found += 1
+                if args.dry_run != 'dry_run':
+                    left.append(file)
+        if added:
+            snapshot.refresh()
         numcategory = Counter(categories)
         if args.dry_run == 'dry_run':
             for c in numcategory:
@@ -270,208 +1296,684 @@ def cross_seed():
                 torrents_added += f'\n - {c} .torrents not added: {numcategory[c]}'
             torrents_added += f'\n -- Total .torrents not added: {total}'
             logger.dryrun(torrents_added)
+            if not_found:
+                logger.dryrun(f'{not_found} .torrent file(s) in {dir_cs} not found in torrents.')
         else:
             for c in numcategory:
                 total += numcategory[c]
                 torrents_added += f'\n - {c} .torrents added: {numcategory[c]}'
             torrents_added += f'\n -- Total .torrents added: {total}'
             logger.info(torrents_added)
+            if incomplete:
+                logger.info(f'{incomplete} .torrent file(s) in {dir_cs} have an original torrent that is not complete. Not added to qBittorrent.')
+            if not_found:
+                logger.warning(f'{not_found} .torrent file(s) in {dir_cs} not found in torrents.')
+    return left
 
 
-def update_category():
-    if args.manage == 'manage' or args.cat_update == 'cat_update':
-        num_cat = 0
-        torrent_list = client.torrents.info(sort='added_on',reverse=True)
-        for torrent in torrent_list:
-            if torrent.category == '':
-                for x in torrent.trackers:
-                    if x.url.startswith('http'):
-                        t_url = trunc_val(x.url, '/')
-                        new_cat = get_category(torrent.save_path)
-                        if args.dry_run == 'dry_run':
-                            logger.dryrun(f'\n - Torrent Name: {torrent.name}'
-                                          f'\n - New Category: {new_cat}'
-                                          f'\n - Tracker: {t_url}')
-                            num_cat += 1
-                        else:
-                            logger.info(f'\n - Torrent Name: {torrent.name}'
-                                        f'\n - New Category: {new_cat}'
-                                        f'\n - Tracker: {t_url}')
-                            torrent.set_category(category=new_cat)
-                            num_cat += 1
-        if args.dry_run == 'dry_run':
-            if num_cat >= 1:
-                logger.dryrun(f'Did not update {num_cat} new categories.')
-            else:
-                logger.dryrun(f'No new torrents to categorize.')
-        else:
-            if num_cat >= 1:
-                logger.info(f'Updated {num_cat} new categories.')
-            else:
-                logger.info(f'No new torrents to categorize.')
+# Decoded tracker state of one torrent, built once per torrent and shared by every rule:
+# the http(s) tracker URLs, the first one truncated to its domain, and the message and URL of the first
+# tracker whose message matches an `unregistered` pattern (None if the torrent is registered everywhere).
+class TrackerView:
+    __slots__ = ('urls', 'url', 'unregistered')
 
+    def __init__(self, trackers=()):
+        http = [x for x in trackers if x.url.startswith('http')]
+        self.urls = [x.url for x in http]
+        self.url = trunc_val(http[0].url, '/') if http else ''
+        self.unregistered = next(((x.msg, trunc_val(x.url, '/')) for x in http if unregistered_re.search(x.msg)), None)
 
-def update_tags():
-    if args.manage == 'manage' or args.tag_update == 'tag_update':
-        num_tags = 0
-        torrent_list = client.torrents.info(sort='added_on',reverse=True)
-        for torrent in torrent_list:
-            if torrent.tags == '':
-                new_tag,t_url = get_tags([x.url for x in torrent.trackers if x.url.startswith('http')])
-                if args.dry_run == 'dry_run':
-                    logger.dryrun(f'\n - Torrent Name: {torrent.name}'
-                                    f'\n - New Tag: {new_tag}'
-                                    f'\n - Tracker: {t_url}')
-                    num_tags += 1
-                else:
-                    logger.info(f'\n - Torrent Name: {torrent.name}'
-                                f'\n - New Tag: {new_tag}'
-                                f'\n - Tracker: {t_url}')
-                    torrent.add_tags(tags=new_tag)
-                    num_tags += 1
-        if args.dry_run == 'dry_run':
-            if num_tags >= 1:
-                logger.dryrun(f'Did not update {num_tags} new tags.')
-            else:
-                logger.dryrun('No new torrents to tag.')
-        else:
-            if num_tags >= 1:
-                logger.info(f'Updated {num_tags} new tags.')
-            else:
-                logger.info('No new torrents to tag. ')
 
+# Rules evaluated by RulePipeline for every torrent. A rule only looks at the torrent, its TrackerView and the
+# TorrentStore, and adds the actions it decides to the plan; it never calls the WebUI.
+def category_rule(pipeline, torrent, view):
+    if torrent.category == '' and view.urls:
+        new_cat = get_category(torrent.save_path)
+        pipeline.add('update_category', 'set_category', torrent, new_cat, category=new_cat, tracker=view.url)
 
-def rem_unregistered():
-    if args.manage == 'manage' or args.rem_unregistered == 'rem_unregistered':
-        torrent_list = client.torrents.info(sort='added_on',reverse=True)
-        torrentdict = get_torrent_info(torrent_list)
-        rem_unr = 0
-        del_tor = 0
-        for torrent in torrent_list:
-            t_name = torrent.name
-            t_count = torrentdict[t_name]['count']
-            t_msg = torrentdict[t_name]['msg']
-            for x in torrent.trackers:
-                if x.url.startswith('http'):
-                    t_url = trunc_val(x.url, '/')
-                    n_info = (f'\n - Torrent Name: {t_name} '
-                              f'\n - Status: {x.msg} '
-                              f'\n - Tracker: {t_url} '
-                              f'\n - Deleted .torrent but not content files.')
-                    n_d_info = (f'\n - Torrent Name: {t_name} '
-                                f'\n - Status: {x.msg} '
-                                f'\n - Tracker: {t_url} '
-                                f'\n - Deleted .torrent AND content files.')
-                    if 'Unregistered torrent' in x.msg or 'Torrent is not found' in x.msg or 'Torrent not registered' in x.msg:
-                        if t_count > 1:
-                            if args.dry_run == 'dry_run':
-                                if '' in t_msg: 
-                                    logger.dryrun(n_info)
-                                    rem_unr += 1
-                                else:
-                                    logger.dryrun(n_d_info)
-                                    del_tor += 1
-                            else:
-                                # Checks if any of the original torrents are working
-                                if '' in t_msg: 
-                                    logger.info(n_info)
-                                    torrent.delete(hash=torrent.hash, delete_files=False)
-                                    rem_unr += 1
-                                else:
-                                    logger.info(n_d_info)
-                                    torrent.delete(hash=torrent.hash, delete_files=True)
-                                    del_tor += 1                                  
-                        else:
-                            if args.dry_run == 'dry_run':
-                                logger.dryrun(n_d_info)
-                                del_tor += 1
-                            else:
-                                logger.info(n_d_info)
-                                torrent.delete(hash=torrent.hash, delete_files=True)
-                                del_tor += 1
-        if args.dry_run == 'dry_run':
-            if rem_unr >= 1 or del_tor >= 1:
-                logger.dryrun(f'Did not delete {rem_unr} .torrents(s) or content files.')
-                logger.dryrun(f'Did not delete {del_tor} .torrents(s) or content files.')
-            else:
-                logger.dryrun('No unregistered torrents found.')
-        else:
-            if rem_unr >= 1 or del_tor >= 1:
-                logger.info(f'Deleted {rem_unr} .torrents(s) but not content files.')
-                logger.info(f'Deleted {del_tor} .torrents(s) AND content files.')
-            else:
-                logger.info('No unregistered torrents found.')
 
-def rem_orphaned():
-    if args.rem_orphaned == 'rem_orphaned':
-        torrent_list = client.torrents.info()
-        torrent_files = []
-        root_files = []
-        orphaned_files = []
+def tags_rule(pipeline, torrent, view):
+    if torrent.tags == '':
+        new_tag, t_url = get_tags(view.urls)
+        # Trackers without a tag are only counted for TagMatcher.report_unmatched()
+        if new_tag:
+            pipeline.add('update_tags', 'add_tags', torrent, new_tag, tag=new_tag, tracker=t_url)
 
-        if 'root_dir' in cfg['directory']:
-            root_path = os.path.join(cfg['directory']['root_dir'], '')
-        else:
-            logger.error('root_dir not defined in config.')
+
+# Paused torrents are tagged by recheck even when tags are not updated otherwise
+def paused_tags_rule(pipeline, torrent, view):
+    if torrent.state_enum.is_paused:
+        tags_rule(pipeline, torrent, view)
+
+
+def unregistered_rule(pipeline, torrent, view):
+    if view.unregistered:
+        msg, t_url = view.unregistered
+        # Checks if any of the original torrents are working, then only the .torrent is deleted
+        group = pipeline.store.group(torrent.name)
+        delete_files = not (group.count > 1 and pipeline.store.any_working(torrent.name))
+        pipeline.add('rem_unregistered', 'delete', torrent, delete_files, status=msg, tracker=t_url)
+
+
+# Resume completed paused torrents and recheck empty ones. Whether a complete copy exists is checked when the
+# plan is applied, after unregistered torrents are removed and cross-seeds are added.
+def recheck_rule(pipeline, torrent, view):
+    if torrent.state_enum.is_paused:
+        if torrent.progress == 1:
+            pipeline.add('recheck', 'resume', torrent)
+        elif torrent.progress == 0:
+            pipeline.add('recheck', 'recheck', torrent)
+
+
+# Runs the enabled stages (update_category, update_tags, rem_unregistered and recheck) as rules over one pass of
+# the torrent list, newest first, and collects their decisions into a single action plan.
+# apply() then carries out the plan one stage group at a time so the stages keep their order: categories, tags and
+# deletions are sent first, cross_seed runs, and recheck() evaluates the torrents it added before applying the
+# rechecks. Trackers are only fetched for torrents a rule needs them for.
+class RulePipeline:
+    rules = [
+        ('update_category', category_rule),
+        ('update_tags', tags_rule),
+        ('rem_unregistered', unregistered_rule),
+        ('recheck', recheck_rule),
+    ]
+
+    def __init__(self, snapshot, stages=None):
+        self.snapshot = snapshot
+        self.enabled = set()
+        if args.manage == 'manage' or args.cat_update == 'cat_update':
+            self.enabled.add('update_category')
+        if args.manage == 'manage' or args.tag_update == 'tag_update':
+            self.enabled.add('update_tags')
+        if args.manage == 'manage' or args.rem_unregistered == 'rem_unregistered':
+            self.enabled.add('rem_unregistered')
+        if args.cross_seed == 'cross_seed' or args.manage == 'manage' or args.recheck == 'recheck':
+            self.enabled.add('recheck')
+        if stages is not None:
+            self.enabled &= set(stages)
+        self.active = [rule for stage, rule in self.rules if stage in self.enabled]
+        if 'recheck' in self.enabled and 'update_tags' not in self.enabled:
+            self.active.insert(0, paused_tags_rule)
+        self.store = None
+        self.plan = []
+        self.seen = set()
+        self.summarized = set()
+
+    def add(self, stage, action, torrent, arg=None, **fields):
+        self.plan.append((stage, action, torrent, arg, fields))
+
+    def needs_trackers(self, torrent):
+        return ('rem_unregistered' in self.enabled
+                or (torrent.category == '' and 'update_category' in self.enabled)
+                or (torrent.tags == '' and ('update_tags' in self.enabled
+                                            or ('recheck' in self.enabled and torrent.state_enum.is_paused))))
+
+    def evaluate(self, torrents=None):
+        if not self.active:
             return
+        if torrents is None:
+            torrents = self.snapshot.list(sort='added_on', reverse=True)
+        if self.store is None and self.enabled & {'rem_unregistered', 'recheck'}:
+            self.store = self.snapshot.store()
+        wanted = {t.hash for t in torrents if self.needs_trackers(t)}
+        self.snapshot.prefetch_trackers([t for t in torrents if t.hash in wanted])
+        empty = TrackerView()
+        for torrent in torrents:
+            self.seen.add(torrent.hash)
+            view = TrackerView(self.snapshot.trackers(torrent)) if torrent.hash in wanted else empty
+            for rule in self.active:
+                rule(self, torrent, view)
 
-        if 'remote_dir' in cfg['directory']:
-            remote_path = os.path.join(cfg['directory']['remote_dir'], '')
-            root_files = [os.path.join(path.replace(remote_path,root_path), name) for path, subdirs, files in os.walk(remote_path) for name in files if os.path.join(remote_path,'orphaned_data') not in path]
-        else:
-            remote_path = root_path
-            root_files = [os.path.join(path, name) for path, subdirs, files in os.walk(root_path) for name in files if os.path.join(root_path,'orphaned_data') not in path]
+    # Carry out the planned actions of the given stages and log a summary for each enabled one
+    def apply(self, batcher, stages, scheduler=None):
+        snapshot = self.snapshot
+        dry_run = args.dry_run == 'dry_run'
+        actions = [item for item in self.plan if item[0] in stages]
+        self.plan = [item for item in self.plan if item[0] not in stages]
+        counts = Counter()
+        for stage, action, torrent, arg, fields in actions:
+            result = action
+            if action == 'set_category':
+                if not dry_run:
+                    snapshot.update(torrent, category=arg)
+            elif action == 'add_tags':
+                if not dry_run:
+                    snapshot.update(torrent, tags=arg)
+            elif action == 'delete':
+                result = 'delete_with_data' if arg else 'delete'
+                if not dry_run:
+                    snapshot.remove(torrent)
+            else:
+                # Torrents removed by rem_unregistered are not resumed or rechecked
+                store = snapshot.store()
+                if store.get(torrent.hash) is None:
+                    continue
+                if action == 'recheck':
+                    if not store.group(torrent.name).any_complete:
+                        continue
+                    # Recheck (started by the scheduler so only a few torrents are checked at a time)
+                    if not dry_run:
+                        run_report.item(stage, 'queue_recheck', torrent.name, **fields)
+                        scheduler.enqueue(torrent)
+                        counts[stage, action] += 1
+                        continue
+            run_report.item(stage, result, torrent.name, **fields)
+            batcher.queue(action, torrent, arg)
+            counts[stage, result] += 1
+        batcher.flush()
+        for stage in stages:
+            if stage in self.enabled and stage not in self.summarized:
+                log_summary(stage, counts)
+                self.summarized.add(stage)
 
-        for torrent in torrent_list:
-            for file in torrent.files:
-                torrent_files.append(os.path.join(torrent.save_path,file.name))
-            
-        orphaned_files = set(root_files) - set(torrent_files)
-        orphaned_files = sorted(orphaned_files)
-        #print('----------torrent files-----------')
-        #print("\n".join(torrent_files))
-        # print('----------root_files-----------')
-        # print("\n".join(root_files))
-        # print('----------orphaned_files-----------')
-        # print("\n".join(orphaned_files))
-        # print('----------Deleting orphan files-----------')
-        if (orphaned_files):
+    # Evaluate the torrents added since the main pass (cross-seeds) and apply the tags and rechecks
+    def recheck(self, batcher):
+        if 'recheck' not in self.enabled:
+            return
+        self.active = [paused_tags_rule, recheck_rule]
+        self.evaluate([t for t in self.snapshot.list(sort='added_on', reverse=True) if t.hash not in self.seen])
+        scheduler = RecheckScheduler(self.snapshot.client, self.snapshot.instance.db_file)
+        try:
+            self.apply(batcher, ('update_tags', 'recheck'), scheduler)
+            if args.dry_run != 'dry_run':
+                scheduler.process(self.snapshot, batcher)
+        finally:
+            scheduler.close()
+
+
+# Log the outcome of one stage of the pipeline from the number of torrents per (stage, action)
+def log_summary(stage, counts):
+    log = logger.dryrun if args.dry_run == 'dry_run' else logger.info
+    if stage == 'update_category':
+        num_cat = counts['update_category', 'set_category']
+        if num_cat >= 1:
+            log(f'Did not update {num_cat} new categories.' if args.dry_run == 'dry_run' else f'Updated {num_cat} new categories.')
+        else:
+            log('No new torrents to categorize.')
+    elif stage == 'update_tags':
+        num_tags = counts['update_tags', 'add_tags']
+        if num_tags >= 1:
+            log(f'Did not update {num_tags} new tags.' if args.dry_run == 'dry_run' else f'Updated {num_tags} new tags.')
+        else:
+            log('No new torrents to tag.')
+    elif stage == 'rem_unregistered':
+        rem_unr = counts['rem_unregistered', 'delete']
+        del_tor = counts['rem_unregistered', 'delete_with_data']
+        if rem_unr >= 1 or del_tor >= 1:
             if args.dry_run == 'dry_run':
-                dir_out = os.path.join(remote_path,'orphaned_data')
-                logger.dryrun(f'\n----------{len(orphaned_files)} Orphan files found-----------'
-                                f'\n - '+'\n - '.join(orphaned_files)+
-                                f'\n - Did not move {len(orphaned_files)} Orphaned files to {dir_out.replace(remote_path,root_path)}')
+                log(f'Did not delete {rem_unr} .torrents(s) or content files.')
+                log(f'Did not delete {del_tor} .torrents(s) or content files.')
             else:
-                dir_out = os.path.join(remote_path,'orphaned_data')
-                os.makedirs(dir_out,exist_ok=True)
-
-                for file in orphaned_files:
-                    src = file.replace(root_path,remote_path)
-                    dest = os.path.join(dir_out,file.replace(root_path,''))
-                    src_path = trunc_val(src, '/',len(remote_path.split('/')))
-                    dest_path = os.path.dirname(dest)
-                    if os.path.isdir(dest_path) == False:
-                        os.makedirs(dest_path)
-                    shutil.move(src, dest)
-                logger.info(f'\n----------{len(orphaned_files)} Orphan files found-----------'
-                                f'\n - '+'\n - '.join(orphaned_files)+
-                                f'\n - Moved {len(orphaned_files)} Orphaned files to {dir_out.replace(remote_path,root_path)}')
-                #Delete empty directories after moving orphan files
-                remove_empty_directories(Path(remote_path))
+                log(f'Deleted {rem_unr} .torrents(s) but not content files.')
+                log(f'Deleted {del_tor} .torrents(s) AND content files.')
         else:
+            log('No unregistered torrents found.')
+    elif stage == 'recheck':
+        num_resume = counts['recheck', 'resume']
+        num_recheck = counts['recheck', 'recheck']
+        if num_resume or num_recheck:
             if args.dry_run == 'dry_run':
-                logger.dryrun('No Orphaned Files found.')
+                log(f'Did not resume {num_resume} completed torrent(s) or recheck {num_recheck} paused torrent(s).')
             else:
-                logger.info('No Orphaned Files found.')
+                log(f'Resumed {num_resume} completed torrent(s) and queued {num_recheck} paused torrent(s) for recheck.')
+        else:
+            log('No paused torrents to resume or recheck.')
+
+
+# On-disk index of every torrent's file list, stored in a SQLite database next to the config file.
+# sync() only fetches files for hashes it has not seen before, updates the save path of moved torrents and
+# drops torrents that are gone. Files and folders can be renamed in qBittorrent, so the content path (relative
+# to the save path) is stored as well and the files of a torrent whose content path changed are fetched again.
+# Renaming a file inside the torrent's folder leaves the content path alone; owners() finds the torrents whose
+# folder holds a given file so their files can be fetched again (refetch()) before that file is called an orphan.
+# Torrents without files yet (magnets still fetching metadata) are not stored so they are retried next run.
+class FileIndex:
+    def __init__(self, path):
+        import sqlite3
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS torrents (hash TEXT PRIMARY KEY, save_path TEXT NOT NULL, content_name TEXT);
+            CREATE TABLE IF NOT EXISTS files (hash TEXT NOT NULL, name TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS files_hash ON files (hash);
+        ''')
+        # Indexes saved by older versions have no content path; their torrents are fetched again once
+        if 'content_name' not in [column[1] for column in self.db.execute('PRAGMA table_info(torrents)')]:
+            with self.db:
+                self.db.execute('ALTER TABLE torrents ADD COLUMN content_name TEXT')
+
+    @staticmethod
+    def content_name(torrent):
+        content_path = torrent.get('content_path')
+        return os.path.relpath(content_path, torrent.save_path) if content_path else None
+
+    def sync(self, torrents, workers):
+        known = {t_hash: (save_path, content_name)
+                 for t_hash, save_path, content_name in self.db.execute('SELECT hash, save_path, content_name FROM torrents')}
+        current = {torrent.hash for torrent in torrents}
+        removed = [(t_hash,) for t_hash in known if t_hash not in current]
+        moved = [(torrent.save_path, torrent.hash) for torrent in torrents
+                 if torrent.hash in known and known[torrent.hash][0] != torrent.save_path]
+        renamed = [torrent for torrent in torrents if torrent.hash in known
+                   and known[torrent.hash][1] != self.content_name(torrent) and self.content_name(torrent) is not None]
+        added = [torrent for torrent in torrents if torrent.hash not in known]
+        with self.db:
+            self.db.executemany('DELETE FROM files WHERE hash = ?', removed)
+            self.db.executemany('DELETE FROM torrents WHERE hash = ?', removed)
+            self.db.executemany('UPDATE torrents SET save_path = ? WHERE hash = ?', moved)
+        self.refetch(renamed + added, workers)
+        logger.debug(f'File index: fetched {len(added)} new and {len(renamed)} renamed, updated {len(moved)} moved'
+                     f' and dropped {len(removed)} removed torrents.')
+
+    # Fetch the files of the given torrents and replace what the index has for them
+    def refetch(self, torrents, workers):
+        with self.db:
+            for torrent, files in zip(torrents, fetch_parallel(lambda t: t.files, torrents, workers)):
+                self.db.execute('DELETE FROM files WHERE hash = ?', (torrent.hash,))
+                self.db.execute('DELETE FROM torrents WHERE hash = ?', (torrent.hash,))
+                if files:
+                    self.db.execute('INSERT INTO torrents VALUES (?, ?, ?)', (torrent.hash, torrent.save_path, self.content_name(torrent)))
+                    self.db.executemany('INSERT INTO files VALUES (?, ?)', [(torrent.hash, file.name) for file in files])
+
+    # Hashes of the torrents whose top folder contains one of `paths`
+    def owners(self, paths):
+        folders = {}
+        for t_hash, save_path, name in self.db.execute('SELECT hash, torrents.save_path, files.name FROM files JOIN torrents USING (hash)'):
+            if '/' in name:
+                folders.setdefault(os.path.join(save_path, name.split('/', 1)[0]), set()).add(t_hash)
+        owners = set()
+        for path in paths:
+            parent = os.path.dirname(path)
+            while parent and parent not in folders and os.path.dirname(parent) != parent:
+                parent = os.path.dirname(parent)
+            owners |= folders.get(parent, set())
+        return owners
 
+    # Full path of every file referenced by the given torrents
+    def torrent_paths(self, hashes):
+        for t_hash in hashes:
+            for save_path, name in self.db.execute('SELECT torrents.save_path, files.name FROM files JOIN torrents USING (hash)'
+                                                   ' WHERE hash = ?', (t_hash,)):
+                yield os.path.join(save_path, name)
+
+    # Stream the full path of every file referenced by a torrent
+    def paths(self):
+        for save_path, name in self.db.execute('SELECT torrents.save_path, files.name FROM files JOIN torrents USING (hash)'):
+            yield os.path.join(save_path, name)
+
+    def close(self):
+        self.db.close()
+
+
+# Listing of every scanned directory keyed by path and modification time, stored next to the FileIndex.
+# Adding, removing or renaming an entry updates the directory mtime, so an unchanged mtime means the
+# cached listing is still valid and the directory does not need to be read again.
+class DirManifest:
+    def __init__(self, db):
+        self.db = db
+        self.db.execute('CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime INTEGER NOT NULL, files TEXT NOT NULL, subdirs TEXT NOT NULL)')
+        self.seen = set()
+
+    def get(self, path):
+        self.seen.add(path)
+        row = self.db.execute('SELECT mtime, files, subdirs FROM dirs WHERE path = ?', (path,)).fetchone()
+        if row:
+            return row[0], self._unpack(row[1]), self._unpack(row[2])
+
+    def put(self, path, mtime, files, subdirs):
+        self.db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)', (path, mtime, '\0'.join(files), '\0'.join(subdirs)))
+
+    # Drop directories that were not reached by this scan and save the changes
+    def commit(self):
+        gone = [(path,) for path, in self.db.execute('SELECT path FROM dirs') if path not in self.seen]
+        self.db.executemany('DELETE FROM dirs WHERE path = ?', gone)
+        self.db.commit()
+
+    @staticmethod
+    def _unpack(names):
+        return names.split('\0') if names else []
+
+
+# Read one directory and split it into files and subdirectories the way os.walk does
+# (symlinks to directories are neither listed as files nor followed).
+# If the directory's mtime matches the cached listing the cached listing is returned instead.
+def _scan_dir(path, cached=None):
+    mtime = os.stat(path).st_mtime_ns
+    if cached and cached[0] == mtime:
+        return path, mtime, cached[1], cached[2], True
+    files = []
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if not is_dir:
+                files.append(entry.name)
+            elif not entry.is_symlink():
+                subdirs.append(entry.name)
+    return path, mtime, files, subdirs, False
+
+
+# Walk `top` with a pool of `workers` threads and yield every file as soon as its directory has been read.
+# Directories listed in `exclude` are skipped together with everything below them.
+def scan_files(top, exclude=(), workers=4, manifest=None):
+    top = os.path.join(top, '')
+    exclude = {os.path.normpath(path) for path in exclude}
+    scan_start = time.time_ns()
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        pending = {executor.submit(_scan_dir, top, manifest.get(top) if manifest else None)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    path, mtime, files, subdirs, cached = future.result()
+                except OSError as e:
+                    logger.warning(f'Unable to scan {e.filename}: {e.strerror}')
+                    continue
+                if manifest and not cached and mtime < scan_start - 2 * 10 ** 9:
+                    manifest.put(path, mtime, files, subdirs)
+                for name in subdirs:
+                    subdir = os.path.join(path, name)
+                    if os.path.normpath(subdir) not in exclude:
+                        pending.add(executor.submit(_scan_dir, subdir, manifest.get(subdir) if manifest else None))
+                for name in files:
+                    yield os.path.join(path, name)
+    if manifest:
+        manifest.commit()
+
+
+# Function used to move the files below root_dir that no torrent references.
+# The torrent files of every instance are collected first and translated to paths on this host (remote_dir),
+# then each host folder is scanned once against all of them, so instances sharing a disk don't report each
+# other's files. A folder inside another instance's folder is covered by the outer scan. A folder is skipped if
+# the torrents of an instance using it could not be listed in this run.
+# Before anything is moved, the torrents whose folder holds an orphan have their files fetched again, so a file
+# renamed in qBittorrent since it was indexed is not taken for an orphan.
+def rem_orphaned(snapshots):
+    if args.rem_orphaned == 'rem_orphaned':
+        orphaned_cfg = cfg.get('orphaned') or {}
+        roots = []
+        for instance in instances:
+            if 'root_dir' in instance.directory:
+                root_path = os.path.join(instance.directory['root_dir'], '')
+                remote_path = os.path.join(instance.directory.get('remote_dir', root_path), '')
+                roots.append((instance, root_path, remote_path))
+            else:
+                logger.error(f'root_dir not defined in config{"" if len(instances) == 1 else f" for {instance.name}"}.')
+        healthy = {snapshot.instance.name: snapshot for snapshot in snapshots if not snapshot.failed}
+
+        torrent_files = set()
+        indexes = []
+        try:
+            for instance, root_path, remote_path in roots:
+                if instance.name not in healthy:
+                    continue
+                file_index = FileIndex(instance.db_file)
+                indexes.append((instance, root_path, remote_path, file_index))
+                token = current_instance.set(instance.name)
+                try:
+                    file_index.sync(healthy[instance.name].list(full=True), instance.max_workers)
+                    torrent_files.update(remote_path + path[len(root_path):] if path.startswith(root_path) else path
+                                         for path in file_index.paths())
+                finally:
+                    current_instance.reset(token)
+
+            # Fetch the files of the torrents owning the orphans again and return the files that are still orphans
+            def verify(orphaned_files):
+                for instance, root_path, remote_path, file_index in indexes:
+                    paths = [root_path + file[len(remote_path):] for file in orphaned_files if file.startswith(remote_path)]
+                    owners = file_index.owners(paths)
+                    if not owners:
+                        continue
+                    torrents = {torrent.hash: torrent for torrent in healthy[instance.name].list(full=True)}
+                    file_index.refetch([torrents[t_hash] for t_hash in owners if t_hash in torrents], instance.max_workers)
+                    torrent_files.update(remote_path + path[len(root_path):] if path.startswith(root_path) else path
+                                         for path in file_index.torrent_paths(owners))
+                    logger.debug(f'Fetched the files of {len(owners)} torrent(s) of {instance.name} again before moving orphans.')
+                return [file for file in orphaned_files if file not in torrent_files]
+
+            exclude = [os.path.join(remote_path, 'orphaned_data') for instance, root_path, remote_path in roots]
+            scanned = set()
+            for instance, root_path, remote_path in roots:
+                if remote_path in scanned or any(remote_path != other and remote_path.startswith(other) for i, r, other in roots):
+                    continue
+                scanned.add(remote_path)
+                members = [i.name for i, r, other in roots if other.startswith(remote_path)]
+                token = current_instance.set('+'.join(members))
+                try:
+                    missing = [name for name in members if name not in healthy]
+                    if missing:
+                        logger.error(f'Skipping orphaned files in {root_path}: the torrents of {", ".join(missing)} could not be listed.')
+                        continue
+                    move_orphans(instance, root_path, remote_path, torrent_files, verify, exclude, orphaned_cfg)
+                finally:
+                    current_instance.reset(token)
+        finally:
+            for instance, root_path, remote_path, file_index in indexes:
+                file_index.close()
+
+
+def move_orphans(instance, root_path, remote_path, torrent_files, verify, exclude, orphaned_cfg):
+    import sqlite3
+    manifest_db = sqlite3.connect(instance.db_file) if orphaned_cfg.get('mtime_cache', False) else None
+    try:
+        root_files = scan_files(remote_path,
+                                exclude=exclude,
+                                workers=orphaned_cfg.get('workers', 4),
+                                manifest=DirManifest(manifest_db) if manifest_db else None)
+        orphaned_files = sorted(file for file in root_files if file not in torrent_files)
+    finally:
+        if manifest_db:
+            manifest_db.close()
+    if orphaned_files:
+        orphaned_files = verify(orphaned_files)
+    if (orphaned_files):
+        dir_out = os.path.join(remote_path,'orphaned_data')
+        if args.dry_run == 'dry_run':
+            for file in orphaned_files:
+                run_report.item('rem_orphaned', 'move_orphan', root_path + file[len(remote_path):])
+            metrics.action('move_orphan', len(orphaned_files))
+            logger.dryrun(f'{len(orphaned_files)} Orphan files found.'
+                          f' Did not move {len(orphaned_files)} Orphaned files to {dir_out.replace(remote_path,root_path)}')
+        else:
+            moves = [(file, os.path.join(dir_out, file[len(remote_path):])) for file in orphaned_files]
+            failed = {src for src, dest in move_files(moves, workers=orphaned_cfg.get('workers', 4))}
+            for src, dest in moves:
+                run_report.item('rem_orphaned', 'move_failed' if src in failed else 'move_orphan', root_path + src[len(remote_path):])
+            metrics.action('move_orphan', len(moves) - len(failed))
+            logger.info(f'{len(orphaned_files)} Orphan files found.'
+                        f' Moved {len(orphaned_files) - len(failed)} Orphaned files to {dir_out.replace(remote_path,root_path)}')
+            #Delete the directories left empty after moving orphan files
+            remove_empty_directories({os.path.dirname(src) for src, dest in moves}, remote_path)
+    else:
+        if args.dry_run == 'dry_run':
+            logger.dryrun('No Orphaned Files found.')
+        else:
+            logger.info('No Orphaned Files found.')
+
+
+# Minimal ctypes wrapper around Linux inotify for a single directory.
+# read() waits up to `timeout` seconds and returns the names of the files that triggered the watched events.
+class Inotify:
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+
+    def __init__(self, path, mask):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), path)
+
+    def read(self, timeout=None):
+        import select
+        import struct
+        names = []
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return names
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = struct.unpack_from('iIII', data, offset)
+                offset += 16
+                names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+                offset += length
+
+    def close(self):
+        os.close(self.fd)
+
+
+# Add new cross-seed .torrent files as soon as they are written, between daemon runs.
+# The torrent table is brought up to date with one sync delta before matching, and files whose original
+# torrent is missing or incomplete are retried after the next daemon run instead of rescanning the directory.
+class CrossSeedWatcher:
+    def __init__(self, instance, table):
+        self.instance = instance
+        self.table = table
+        self.inotify = Inotify(os.path.join(instance.directory['cross_seed'], ''), Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO)
+        self.waiting = set()
+
+    def wait(self, timeout):
+        current_instance.set(self.instance.name)
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            cs_files = {name for name in self.inotify.read(remaining) if name.endswith('.torrent')}
+            if cs_files:
+                # Kept in `waiting` until cross_seed returns, so they are not lost if qBittorrent can't be reached
+                self.waiting.update(cs_files)
+                run_report.start()
+                snapshot = TorrentSnapshot(self.instance, self.table, self.table.update(pending=True))
+                left = cross_seed(snapshot, sorted(cs_files))
+                self.waiting.difference_update(cs_files)
+                self.waiting.update(left)
+                RulePipeline(snapshot, ['recheck']).recheck(WriteBatcher(snapshot.instance))
+                tag_matcher.report_unmatched()
+
+    # Files left over from earlier events, retried on every daemon run
+    def retry(self):
+        cs_files, self.waiting = sorted(self.waiting), set()
+        return cs_files
+
+    def close(self):
+        self.inotify.close()
+
+
+# Run every stage except rem_orphaned on one instance. Runs in the instance's own worker thread when
+# there are several instances. A lost connection only fails this instance's run.
+def run_instance(snapshot, cs_files=None):
+    token = current_instance.set(snapshot.instance.name)
+    try:
+        if snapshot.table is not None and snapshot.changed is None:
+            snapshot.changed = snapshot.table.changes()
+            logger.debug(f'{len(snapshot.changed)} of {len(snapshot.table.torrents)} torrents changed since last run.')
+        batcher = WriteBatcher(snapshot.instance)
+        pipeline = RulePipeline(snapshot)
+        with metrics.stage('rules', bool(pipeline.active)):
+            pipeline.evaluate()
+        with metrics.stage('apply', bool(pipeline.enabled & {'update_category', 'update_tags', 'rem_unregistered'})):
+            pipeline.apply(batcher, ('update_category', 'update_tags', 'rem_unregistered'))
+        with metrics.stage('cross_seed', args.cross_seed == 'cross_seed'):
+            snapshot.left = cross_seed(snapshot, cs_files)
+        with metrics.stage('recheck', 'recheck' in pipeline.enabled):
+            pipeline.recheck(batcher)
+    except connection_errors() as e:
+        logger.error(f'Lost connection to qBittorrent: {e}.')
+        metrics.inc('qbit_manage_run_errors_total', instance=snapshot.instance.name)
+        snapshot.failed = True
+        if snapshot.table is not None:
+            snapshot.table.reset()
+    finally:
+        snapshot.log_stats()
+        current_instance.reset(token)
+    return snapshot
+
+
+# Run the stages on every instance (concurrently when there are several), then look for orphaned files once
+# over all of them. The compiled category and tag rules are shared by every instance.
+def run(snapshots=None, cs_files=None):
+    if snapshots is None:
+        snapshots = [TorrentSnapshot(instance, hashes=args.hashes) for instance in instances]
+    start = time.perf_counter()
+    run_report.start()
+    if len(snapshots) == 1:
+        run_instance(snapshots[0], cs_files)
+    else:
+        with ThreadPoolExecutor(max_workers=len(snapshots)) as executor:
+            list(executor.map(run_instance, snapshots))
+    with metrics.stage('rem_orphaned', args.rem_orphaned == 'rem_orphaned'):
+        rem_orphaned(snapshots)
+    category_matcher.report_unmatched()
+    tag_matcher.report_unmatched()
+    metrics.finish_run(time.perf_counter() - start)
+    write_metrics()
+    return snapshots
+
+
+# Write the metrics textfile after every run when `metrics: textfile:` is set
+def write_metrics():
+    if metrics_cfg.get('textfile'):
+        try:
+            metrics.write_textfile(metrics_cfg['textfile'])
+        except OSError as e:
+            logger.warning(f'Unable to write metrics to {metrics_cfg["textfile"]}: {e.strerror}')
+
+# Keep one logged-in client and an in-memory torrent table per instance, and run the stages every `--interval`
+# seconds only on the torrents that changed since the previous tick.
+# With --watch the cross-seed directory is only listed on the first run; after that new files are picked up
+# by the CrossSeedWatcher while waiting for the next run.
+def daemon():
+    tables = [SyncTable(instance.client) for instance in instances]
+    watcher = CrossSeedWatcher(instances[0], tables[0]) if args.watch == 'watch' else None
+    cs_files = None
+    logger.info(f'Starting daemon mode. Running every {args.interval} seconds.')
+    if metrics_cfg.get('port'):
+        metrics.serve(metrics_cfg['port'], metrics_cfg.get('host', ''))
+        logger.info(f'Serving metrics on port {metrics_cfg["port"]}.')
+    try:
+        while True:
+            try:
+                snapshots = run([TorrentSnapshot(instance, table) for instance, table in zip(instances, tables)], cs_files)
+                if watcher:
+                    watcher.waiting.update(snapshots[0].left)
+                    watcher.wait(args.interval)
+                    cs_files = watcher.retry()
+                    # The files given to a failed run are still in the directory: list it again
+                    if snapshots[0].failed:
+                        cs_files = None
+                    continue
+            except connection_errors() as e:
+                logger.error(f'Lost connection to qBittorrent: {e}. Retrying in {args.interval} seconds.')
+                for table in tables:
+                    table.reset()
+                # List the cross-seed directory again on the next run instead of retrying only the waiting files
+                if watcher:
+                    watcher.retry()
+                cs_files = None
+                # Same labels as the errors counted by run_instance(); --watch has a single instance
+                metrics.inc('qbit_manage_run_errors_total', instance=watcher.instance.name if watcher else '')
+                write_metrics()
+            time.sleep(args.interval)
+    finally:
+        if watcher:
+            watcher.close()
 
-def run():
-    update_category()
-    update_tags()
-    rem_unregistered()
-    cross_seed()
-    recheck()
-    rem_orphaned()
 
 if __name__ == '__main__':
-    run()
+    if args.daemon == 'daemon' or args.watch == 'watch':
+        try:
+            daemon()
+        except KeyboardInterrupt:
+            logger.info('Exiting daemon mode.')
+    else:
+        sys.exit(1 if any(snapshot.failed for snapshot in run()) else 0)
@@ -0,0 +1,55 @@
+import importlib
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+CONFIG = {
+    'qbt': {'host': 'localhost:1', 'user': 'admin', 'pass': 'adminadmin'},
+    'directory': {'cross_seed': '/tmp/cross_seed/', 'root_dir': '/data/torrents/'},
+    'cat': {'movies': '/data/torrents/Movies', 'tv': 'TV'},
+    'tags': {'blutopia': 'Blutopia', 'landof.tv': 'BroadcasTheNet'},
+}
+
+
+# qbit_manage.py parses its arguments and loads the config on import, so it is imported once with a
+# throwaway config, log and report file. The client is only created on first use and is never used here.
+@pytest.fixture(scope='session')
+def qbit_manage(tmp_path_factory):
+    work_dir = tmp_path_factory.mktemp('qbit_manage')
+    config = work_dir / 'config.yml'
+    config.write_text(yaml.safe_dump(CONFIG))
+    argv = sys.argv
+    sys.argv = ['qbit_manage.py', '--config-file', str(config), '--log-file', str(work_dir / 'activity.log'), '--log', 'DEBUG']
+    try:
+        return importlib.import_module('qbit_manage')
+    finally:
+        sys.argv = argv
+
+
+# Minimal stand-in for a TorrentDictionary
+def make_torrent(t_hash, name='Some.Torrent', progress=0, paused=True, checking=False, **fields):
+    state = SimpleNamespace(is_paused=paused, is_checking=checking, is_complete=progress == 1)
+    return SimpleNamespace(hash=t_hash, name=name, progress=progress, state_enum=state, save_path='/data/torrents/Movies',
+                           size=1024, **fields)
+
+
+# Records what a stage queued instead of sending it
+class FakeBatcher:
+    def __init__(self):
+        self.queued = []
+
+    def queue(self, action, torrent, arg=None):
+        self.queued.append((action, torrent.hash, arg))
+
+    def flush(self):
+        pass
+
+
+@pytest.fixture
+def batcher():
+    return FakeBatcher()
@@ -0,0 +1,37 @@
+import pytest
+
+
+@pytest.mark.parametrize('pattern', ['', '.*', 'a|', '(?i)x?'])
+def test_unregistered_pattern_matching_empty_message_is_rejected(qbit_manage, pattern):
+    config = {'qbt': {'host': 'localhost'}, 'cat': {}, 'tags': {}, 'unregistered': ['Unregistered torrent', pattern]}
+    with pytest.raises(SystemExit):
+        qbit_manage.validate_config(config, 'config.yml')
+
+
+def test_unregistered_patterns_with_flags(qbit_manage):
+    config = {'qbt': {'host': 'localhost'}, 'cat': {}, 'tags': {}, 'unregistered': ['Unregistered torrent', '(?i)torrent has been deleted']}
+    qbit_manage.validate_config(config, 'config.yml')
+    pattern = qbit_manage.re.compile('|'.join(map(qbit_manage.unregistered_group, config['unregistered'])))
+    assert pattern.search('Torrent has been deleted.')
+    assert not pattern.search('unregistered torrent')
+    assert not pattern.search('')
+
+
+def test_config_cache_is_created_with_the_config_permissions(qbit_manage, tmp_path, monkeypatch):
+    import os
+    import yaml
+    from conftest import CONFIG
+    config = tmp_path / 'config.yml'
+    config.write_text(yaml.safe_dump(CONFIG))
+    config.chmod(0o600)
+    modes = []
+    real_open = os.open
+    # Permissions the cache file is created with, before anything is written to it
+    def recording_open(path, flags, mode=0o777, **kwargs):
+        modes.append(mode)
+        return real_open(path, flags, mode, **kwargs)
+    monkeypatch.setattr(os, 'open', recording_open)
+    assert qbit_manage.load_config(str(config)) == CONFIG
+    assert modes == [0o600]
+    assert (tmp_path / 'config.cache.json').stat().st_mode & 0o777 == 0o600
+    assert qbit_manage.load_config(str(config)) == CONFIG
@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+
+import pytest
+
+
+# Inotify stand-in returning the given batches of names, then nothing
+class FakeInotify:
+    def __init__(self, *batches):
+        self.batches = list(batches)
+
+    def read(self, timeout=None):
+        return self.batches.pop(0) if self.batches else []
+
+
+class UnreachableTable:
+    def update(self, pending=False):
+        import qbittorrentapi
+        raise qbittorrentapi.APIConnectionError('Connection refused')
+
+
+def test_files_are_kept_when_qbittorrent_is_unreachable(qbit_manage):
+    import qbittorrentapi
+    watcher = object.__new__(qbit_manage.CrossSeedWatcher)
+    watcher.instance = SimpleNamespace(name='')
+    watcher.table = UnreachableTable()
+    watcher.inotify = FakeInotify(['Movie.torrent', 'Movie.nfo'])
+    watcher.waiting = {'Show.torrent'}
+    with pytest.raises(qbittorrentapi.APIConnectionError):
+        watcher.wait(1)
+    assert watcher.retry() == ['Movie.torrent', 'Show.torrent']
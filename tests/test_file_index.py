@@ -0,0 +1,47 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+
+# TorrentDictionary stand-in: fields are read with .get() and as attributes, files with .files
+class Torrent(dict):
+    def __init__(self, t_hash, save_path, content_path, files):
+        super().__init__(hash=t_hash, save_path=save_path, content_path=content_path)
+        self.files = [SimpleNamespace(name=name) for name in files]
+
+    __getattr__ = dict.__getitem__
+
+
+@pytest.fixture
+def file_index(qbit_manage, tmp_path):
+    file_index = qbit_manage.FileIndex(str(tmp_path / 'config.db'))
+    yield file_index
+    file_index.close()
+
+
+def test_renamed_torrent_files_are_fetched_again(file_index):
+    torrent = Torrent('a', '/data/torrents/Movies', '/data/torrents/Movies/Movie.mkv', ['Movie.mkv'])
+    file_index.sync([torrent], workers=1)
+    assert list(file_index.paths()) == ['/data/torrents/Movies/Movie.mkv']
+    renamed = Torrent('a', '/data/torrents/Movies', '/data/torrents/Movies/Movie (2020).mkv', ['Movie (2020).mkv'])
+    file_index.sync([renamed], workers=1)
+    assert list(file_index.paths()) == ['/data/torrents/Movies/Movie (2020).mkv']
+
+
+def test_moved_torrent_keeps_its_files(file_index):
+    torrent = Torrent('a', '/data/torrents/Movies', '/data/torrents/Movies/Movie', ['Movie/Movie.mkv'])
+    file_index.sync([torrent], workers=1)
+    torrent.files = []
+    moved = Torrent('a', '/data/torrents/Old', '/data/torrents/Old/Movie', [])
+    file_index.sync([moved], workers=1)
+    assert list(file_index.paths()) == ['/data/torrents/Old/Movie/Movie.mkv']
+
+
+def test_owners_of_files_in_a_torrent_folder(file_index):
+    file_index.sync([Torrent('a', '/data/torrents/TV', '/data/torrents/TV/Show', ['Show/S01/E01.mkv']),
+                     Torrent('b', '/data/torrents/TV', '/data/torrents/TV/E02.mkv', ['E02.mkv'])], workers=1)
+    assert file_index.owners(['/data/torrents/TV/Show/S01/E01 renamed.mkv', '/data/torrents/TV/other.nfo']) == {'a'}
+    # A file renamed inside the folder is picked up by refetch()
+    file_index.refetch([Torrent('a', '/data/torrents/TV', '/data/torrents/TV/Show', ['Show/S01/E01 renamed.mkv'])], workers=1)
+    assert set(file_index.torrent_paths({'a'})) == {os.path.join('/data/torrents/TV', 'Show/S01/E01 renamed.mkv')}
@@ -0,0 +1,8 @@
+def test_stages_that_are_not_enabled_are_not_timed(qbit_manage):
+    metrics = qbit_manage.Metrics()
+    with metrics.stage('update_tags'):
+        pass
+    with metrics.stage('cross_seed', False):
+        pass
+    durations = metrics.metrics['qbit_manage_stage_duration_seconds']['values']
+    assert [dict(labels)['stage'] for labels in durations] == ['update_tags']
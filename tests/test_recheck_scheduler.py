@@ -0,0 +1,89 @@
+import pytest
+
+from conftest import make_torrent
+
+
+@pytest.fixture
+def scheduler(qbit_manage, tmp_path):
+    scheduler = qbit_manage.RecheckScheduler(None, str(tmp_path / 'config.db'))
+    scheduler.start_timeout = 300
+    yield scheduler
+    scheduler.close()
+
+
+def status(scheduler, t_hash):
+    row = scheduler.db.execute('SELECT status FROM rechecks WHERE hash = ?', (t_hash,)).fetchone()
+    return row[0] if row else None
+
+
+def test_queued_recheck_is_started(scheduler, batcher):
+    torrent = make_torrent('a')
+    scheduler.enqueue(torrent)
+    assert scheduler.step({'a': torrent}, batcher, now=1000) == 1
+    assert batcher.queued == [('recheck', 'a', None)]
+    assert status(scheduler, 'a') == 'started'
+
+
+def test_recheck_finished_at_zero_after_checking_is_incomplete(scheduler, batcher):
+    torrent = make_torrent('a')
+    scheduler.enqueue(torrent)
+    scheduler.step({'a': torrent}, batcher, now=1000)
+    assert scheduler.step({'a': make_torrent('a', paused=False, checking=True)}, batcher, now=1010) == 1
+    assert status(scheduler, 'a') == 'checking'
+    # Back to paused at 0%: the data is missing, the slot is freed
+    assert scheduler.step({'a': make_torrent('a')}, batcher, now=1020) == 0
+    assert status(scheduler, 'a') is None
+
+
+def test_recheck_never_seen_checking_times_out(scheduler, batcher):
+    torrent = make_torrent('a')
+    scheduler.enqueue(torrent)
+    scheduler.step({'a': torrent}, batcher, now=1000)
+    # qBittorrent may not have started the check yet
+    assert scheduler.step({'a': torrent}, batcher, now=1100) == 1
+    assert scheduler.step({'a': torrent}, batcher, now=1300) == 0
+    assert status(scheduler, 'a') is None
+
+
+def test_completed_recheck_is_resumed(scheduler, batcher):
+    torrent = make_torrent('a')
+    scheduler.enqueue(torrent)
+    scheduler.step({'a': torrent}, batcher, now=1000)
+    assert scheduler.step({'a': make_torrent('a', progress=1)}, batcher, now=1010) == 0
+    assert batcher.queued[-1] == ('resume', 'a', None)
+
+
+def test_freed_slot_goes_to_next_torrent(scheduler, batcher):
+    first, second = make_torrent('a'), make_torrent('b')
+    scheduler.enqueue(first)
+    scheduler.enqueue(second)
+    scheduler.step({'a': first, 'b': second}, batcher, now=1000)
+    assert [t_hash for action, t_hash, arg in batcher.queued] == ['a']
+    scheduler.step({'a': make_torrent('a', paused=False, checking=True), 'b': second}, batcher, now=1010)
+    assert scheduler.step({'a': make_torrent('a'), 'b': second}, batcher, now=1020) == 1
+    assert batcher.queued[-1] == ('recheck', 'b', None)
+
+
+def test_queue_saved_without_start_time_is_upgraded(qbit_manage, tmp_path, batcher):
+    import sqlite3
+    db = sqlite3.connect(str(tmp_path / 'old.db'))
+    db.execute('CREATE TABLE rechecks (hash TEXT PRIMARY KEY, name TEXT NOT NULL, root TEXT NOT NULL,'
+               ' size INTEGER NOT NULL, status TEXT NOT NULL)')
+    db.execute("INSERT INTO rechecks VALUES ('a', 'Some.Torrent', '', 1024, 'started')")
+    db.commit()
+    db.close()
+    scheduler = qbit_manage.RecheckScheduler(None, str(tmp_path / 'old.db'))
+    try:
+        assert scheduler.step({'a': make_torrent('a')}, batcher, now=1000) == 0
+    finally:
+        scheduler.close()
+
+
+def test_run_without_daemon_does_not_wait_by_default(scheduler, batcher, monkeypatch):
+    from types import SimpleNamespace
+    torrent = make_torrent('a')
+    scheduler.enqueue(torrent)
+    monkeypatch.setattr('time.sleep', lambda seconds: pytest.fail('waited for the recheck'))
+    scheduler.process(SimpleNamespace(table=None, list=lambda full: [torrent]), batcher)
+    assert batcher.queued == [('recheck', 'a', None)]
+    assert status(scheduler, 'a') == 'started'
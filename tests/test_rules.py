@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+from conftest import make_torrent
+
+
+def tracker_view(qbit_manage, *urls):
+    return qbit_manage.TrackerView([SimpleNamespace(url=url, msg='') for url in urls])
+
+
+def test_tags_rule_tags_known_tracker(qbit_manage):
+    pipeline = qbit_manage.RulePipeline(None, stages=[])
+    torrent = make_torrent('a', tags='')
+    qbit_manage.tags_rule(pipeline, torrent, tracker_view(qbit_manage, 'https://blutopia.xyz/announce/key'))
+    assert [(action, arg) for stage, action, t, arg, fields in pipeline.plan] == [('add_tags', 'Blutopia')]
+
+
+def test_tags_rule_skips_unknown_tracker(qbit_manage):
+    pipeline = qbit_manage.RulePipeline(None, stages=[])
+    torrent = make_torrent('a', tags='')
+    qbit_manage.tags_rule(pipeline, torrent, tracker_view(qbit_manage, 'https://unknown.example/announce'))
+    assert pipeline.plan == []
+    assert qbit_manage.tag_matcher.unmatched['https://unknown.example'] == 1
+
+
+def test_category_full_path_prefix(qbit_manage):
+    matcher = qbit_manage.CategoryMatcher({'movies': '/data/torrents/Movies', 'hd': '/data/torrents/Movies/HD', 'tv': 'TV'})
+    assert matcher.match('/data/torrents/Movies/HD/Film') == 'hd'
+    assert matcher.match('/data/torrents/Movies/Film') == 'movies'
+
+
+def test_category_full_path_inside_another_mount(qbit_manage):
+    matcher = qbit_manage.CategoryMatcher({'movies': '/data/torrents/Movies', 'tv': 'TV'})
+    assert matcher.match('/mnt/data/torrents/Movies') == 'movies'
+    assert matcher.match('/mnt/data/torrents/TV/Show') == 'tv'
+    assert matcher.match('/mnt/data/torrents/Music') == ''
+    assert matcher.unmatched == {'/mnt/data/torrents/Music'}
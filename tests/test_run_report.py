@@ -0,0 +1,30 @@
+import atexit
+import json
+
+
+def read_runs(path):
+    return [json.loads(line)['run'] for line in path.read_text().splitlines()]
+
+
+def test_report_rolls_over_between_runs_only(qbit_manage, tmp_path, monkeypatch):
+    monkeypatch.setattr(qbit_manage, 'report_max_bytes', 1000)
+    path = tmp_path / 'activity.jsonl'
+    report = qbit_manage.RunReport(str(path))
+    try:
+        report.start()
+        report.run = 'first'
+        for i in range(50):
+            report.item('rem_orphaned', 'move_orphan', f'/data/torrents/orphan{i}.mkv')
+        report.start()
+        report.run = 'second'
+        report.item('rem_orphaned', 'move_orphan', '/data/torrents/orphan.mkv')
+    finally:
+        # The report logger is shared with the module's own run report
+        report.logger.removeHandler(report.logger.handlers[-1])
+        report.listener.stop()
+        atexit.unregister(report.listener.stop)
+        for handler in report.listener.handlers:
+            handler.close()
+    # The first run is larger than the limit and is kept whole in the rolled over file
+    assert read_runs(tmp_path / 'activity.jsonl.1') == ['first'] * 50
+    assert read_runs(path) == ['second']
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+
+# Client whose sync/maindata returns the given deltas one after the other
+def fake_client(*deltas):
+    deltas = list(deltas)
+    return SimpleNamespace(sync=SimpleNamespace(maindata=lambda rid: deltas.pop(0)))
+
+
+def test_changes_include_deltas_read_between_ticks(qbit_manage):
+    table = qbit_manage.SyncTable(fake_client(
+        {'rid': 1, 'full_update': True, 'torrents': {'a': {'name': 'A'}}},
+        {'rid': 2, 'torrents': {'b': {'name': 'B'}}},
+        {'rid': 3, 'torrents': {'c': {'name': 'C'}}},
+        {'rid': 4},
+    ))
+    assert table.changes() == {'a'}
+    # Read by the cross-seed watcher between two ticks
+    assert table.update(pending=True) == {'b'}
+    assert table.changes() == {'b', 'c'}
+    assert table.changes() == set()
+
+
+def test_removed_torrents_leave_pending(qbit_manage):
+    table = qbit_manage.SyncTable(fake_client(
+        {'rid': 1, 'full_update': True, 'torrents': {'a': {'name': 'A'}, 'b': {'name': 'B'}}},
+        {'rid': 2, 'torrents': {'a': {'state': 'pausedDL'}}},
+        {'rid': 3, 'torrents_removed': ['a']},
+    ))
+    table.changes()
+    table.update(pending=True)
+    assert table.changes() == set()
+
+
+def test_trackers_of_torrents_without_working_tracker_expire(qbit_manage):
+    table = qbit_manage.SyncTable(fake_client(
+        {'rid': 1, 'full_update': True, 'torrents': {'a': {'tracker': ''}, 'b': {'tracker': 'https://blutopia.xyz/announce'}}},
+        {'rid': 2},
+        {'rid': 3},
+    ))
+    table.changes()
+    table.trackers.update(a=('timed out',), b=('working',))
+    assert table.changes() == set()
+    # Cached for longer than tracker_ttl: only the torrent without a working tracker is looked at again
+    for t_hash in table.cached_at:
+        table.cached_at[t_hash] -= table.tracker_ttl
+    assert table.changes() == {'a'}
+    assert 'a' not in table.trackers and 'b' in table.trackers